@@ -1,8 +1,8 @@
+import math
 import random
 import numpy as np
 import typing as tp
-
-from lib.optimize import optimize
+from itertools import islice
 
 X = tp.TypeVar('X')
 
@@ -22,49 +22,337 @@ class Metric(tp.Protocol[X]):
         pass
 
 
+class Proposer(tp.Protocol[X]):
+    """
+    Operator, which proposes a move with its metric delta first, and makes
+    the neighbour only once the move is accepted, so rejected moves cost no
+    neighbour. Anneal functions take it instead of `Neighbour`, e.g. see
+    `lib.solver.anneal_solver`, and tell the two apart by `propose_move`.
+    """
+
+    def propose_move(self, x: X, epoch: int) -> tuple[tp.Any, float] | None:
+        """ move and `f(neighbour) - f(x)`, x is not changed; None if there is no move """
+
+    def apply_move(self, x: X, move: tp.Any) -> X:
+        """ neighbour, `anneal_inplace` expects x changed in place instead """
+
+
+class EpochRecord(tp.NamedTuple):
+    """
+    What anneal functions yield after each epoch (and once for the initial
+    state, with `nan` temperature): metrics of the current element(s), and
+    number of accepted neighbours. Holds no references to the elements, see
+    `lib.history` on how to keep them.
+    """
+
+    epoch: int
+    temp: float
+    fs: tuple[float, ...]
+    accepted: int
+
+    @property
+    def f(self) -> float:
+        return min(self.fs)
+
+
+def _record(epoch: int, temp: float, currs: list[tuple[X, float]], accepted: int) -> EpochRecord:
+    return EpochRecord(epoch, temp, tuple(f_curr for _curr, f_curr in currs), accepted)
+
+
+class EpochCallback(tp.Protocol[X]):
+    def __call__(self, epoch: int, temp: float, currs: list[tuple[X, float]]) -> None:
+        """ called after `epoch` epochs are done, e.g. see `lib.snapshot` """
+
+
+def _epochs(temp_it: tp.Iterator[float], start_epoch: int) -> tp.Iterator[tuple[int, float]]:
+    """ (epoch, temp) pairs, skipping temperatures of the epochs done before resume """
+    return enumerate(islice(temp_it, start_epoch, None), start_epoch)
+
+
+class LogUniforms:
+    """
+    Stream of `log(u)` for uniform `u` in (0, 1], drawn by numpy in batches.
+    Metropolis test `u <= exp(-(f_next - f_curr) / temp)` is then just
+    `f_next - f_curr <= -temp * log(u)`, see `accept`, so no `exp` and no
+    `random.choices` per neighbour. Temperatures are not pre-drawn, so
+    schedules, which depend on the run (see `lib.temperature.Anytime`), are
+    fine.
+
+    Each batch is seeded by `random`, so seeding `random` reproduces the
+    run as before. Anneal functions `flush` it every `checkpoint_every`
+    epochs, so the run resumed from a checkpoint (see `lib.snapshot`) draws
+    the same batches.
+    """
+
+    def __init__(self, batch: int = 4096) -> None:
+        assert batch > 0
+        self.batch = batch
+        self.it = iter(())
+
+    def draw(self) -> float:
+        try:
+            return next(self.it)
+        except StopIteration:
+            rng = np.random.default_rng(random.getrandbits(64))
+            self.it = iter(np.log1p(-rng.random(self.batch)).tolist())
+            return next(self.it)
+
+    def flush(self) -> None:
+        self.it = iter(())
+
+
+def accept(f_curr: float, f_next: float, temp: float, log_u: float) -> bool:
+    """ Metropolis test with `log_u` drawn from `LogUniforms` """
+    return f_next - f_curr <= -temp * log_u
+
+
+def _after_epoch(
+    epoch: int,
+    temp: float,
+    currs: list[tuple[X, float]],
+    callback: EpochCallback[X] | None,
+    checkpoint: EpochCallback[X] | None,
+    checkpoint_every: int,
+    log_us: LogUniforms,
+) -> None:
+    if callback is not None:
+        callback(epoch + 1, temp, currs)
+    if (epoch + 1) % checkpoint_every == 0:
+        # whether or not checkpoints are written, so they don't change the run
+        log_us.flush()
+        if checkpoint is not None:
+            checkpoint(epoch + 1, temp, currs)
+
+
+def _hold(x) -> None:
+    if hasattr(x, 'hold'):
+        x.hold()
+
+
+def _release(x) -> None:
+    """ lets the diff tree collapse, see `lib.solution.Collapsible` """
+    if hasattr(x, 'release'):
+        x.release()
+
+
+def _unwrap(x):
+    return x.unwrap() if hasattr(x, 'unwrap') else x
+
+
 def evaluate_probability(f_curr: float, f_next: float, temp: float) -> float:
     assert temp > 0
     return np.exp(min(-(f_next - f_curr) / temp, 0))
 
 
-def iterate_anneal(curr: X, f_curr: float, temp: float, f: Metric[X], A: Neighbour[X]):
+def _log_uniform() -> float:
+    return math.log(1.0 - random.random())
+
+
+class MoveObserver(tp.Protocol):
+    def __call__(self, delta: float, accepted: bool) -> None:
+        """ outcome of Metropolis test, `delta` is `f_next - f_curr`, e.g. see `lib.temperature.Adaptive` """
+
+
+def _move_observer(temp_it: tp.Iterator[float]) -> MoveObserver | None:
+    return getattr(temp_it, 'observe_move', None)
+
+
+def iterate_anneal(
+    curr: X, f_curr: float, temp: float, f: Metric[X], A: Neighbour[X],
+    log_u: float | None = None, observe: MoveObserver | None = None,
+):
     """
     :param curr: current iteration element: X
     :param curr_f: metric on current iteration element: float
     :param temp: float > 0
     :param f: metric to minimize: X -> float
     :param A: operator: X -> X
-    :return: next iteration element
+    :param log_u: pre-drawn, see `LogUniforms`, drawn from `random` if None
+    :param observe: called with the outcome of the test
+    :return: next iteration element, rejected one is released
     """
     next = A(curr)
     f_next = f(next)
 
-    take_next_prob = evaluate_probability(f_curr, f_next, temp)
-    return random.choices(
-        [(next, f_next), (curr, f_curr)],
-        cum_weights=[take_next_prob, 1],
-    )[0]
+    accepted = accept(f_curr, f_next, temp, _log_uniform() if log_u is None else log_u)
+    if observe is not None:
+        observe(f_next - f_curr, accepted)
+    if accepted:
+        return next, f_next
+    if next is not curr:
+        _release(next)
+    return curr, f_curr
 
 
-def anneal(init: X, temp_it: tp.Iterator[float], f: Metric[X], A: Neighbour[X]) -> X:
+def iterate_proposal(
+    curr: X, f_curr: float, temp: float, f: Metric[X], P: Proposer[X], epoch: int,
+    log_u: float | None = None, observe: MoveObserver | None = None,
+) -> tuple[X, float, bool]:
     """
-    :param init: initial iteration element: X
-    :param temp_it: iterator over temperatures, Iterator[float > 0]
+    Same as `iterate_anneal`, but the neighbour is made only if accepted.
+
+    :return: next iteration element, metric on it, and whether the move was
+        accepted (next element is the current one, if changed in place)
+    """
+    proposal = P.propose_move(curr, epoch)
+    if proposal is None:
+        return curr, f_curr, False
+    move, delta = proposal
+
+    accepted = accept(f_curr, f_curr + delta, temp, _log_uniform() if log_u is None else log_u)
+    if observe is not None:
+        observe(delta, accepted)
+    if not accepted:
+        return curr, f_curr, False
+    # metric is not accumulated, so it does not drift
+    next = P.apply_move(curr, move)
+    return next, f(next), True
+
+
+def _is_proposer(A) -> bool:
+    return hasattr(A, 'propose_move')
+
+
+def _iterate(
+    curr: X, f_curr: float, temp: float, f: Metric[X], A: Neighbour[X] | Proposer[X], epoch: int,
+    log_u: float | None, observe: MoveObserver | None,
+) -> tuple[X, float]:
+    if _is_proposer(A):
+        next, f_next, _accepted = iterate_proposal(curr, f_curr, temp, f, A, epoch, log_u, observe)
+        return next, f_next
+    return iterate_anneal(curr, f_curr, temp, f, lambda x: A(x, epoch), log_u, observe)
+
+
+def anneal(
+    init: X,
+    temp_it: tp.Iterator[float],
+    f: Metric[X],
+    A: Neighbour[X] | Proposer[X],
+    *,
+    sweep: int = 1,
+    start_epoch: int = 0,
+    checkpoint: EpochCallback[X] | None = None,
+    checkpoint_every: int = 1000,
+    callback: EpochCallback[X] | None = None,
+) -> tp.Iterator[EpochRecord]:
+    """
+    :param init: initial iteration element, the anneal takes over its
+        reference (see `lib.solution.Collapsible`): X
+    :param temp_it: iterator over temperatures, Iterator[float > 0]. If it
+        has `observe_move` (see `MoveObserver`), outcomes of Metropolis tests
+        are passed to it, e.g. see `lib.temperature.Adaptive`
     :param f: metric to minimize: X -> float
-    :param A: operator: X -> X
-    :return: history of pairs (x, f(x))
+    :param A: operator: X -> X, or `Proposer`
+    :param sweep: number of Metropolis tests per epoch, all at the epoch's
+        temperature. Records, callbacks, checkpoints and the schedule step
+        once per epoch, so on small moves their cost is spread over the sweep.
+        Record's `accepted` counts the accepted neighbours of the sweep.
+    :param start_epoch: number of epochs done before resume, their
+        temperatures are skipped
+    :param checkpoint: called every `checkpoint_every` epochs
+    :param callback: called after every epoch, e.g. to keep the best solution
+    :return: stream of epoch records, epochs are run as it is consumed
+    """
+    assert sweep > 0
+    curr, f_curr = init, f(init)
+    log_us, observe = LogUniforms(), _move_observer(temp_it)
+    yield _record(start_epoch, math.nan, [(curr, f_curr)], 0)
+    for epoch, temp in _epochs(temp_it, start_epoch):
+        accepted = 0
+        for i in range(sweep):
+            next, f_next = _iterate(curr, f_curr, temp, f, A, epoch, log_us.draw(), observe)
+            if next is not curr:
+                _release(curr)
+                curr, f_curr = _unwrap(next), f_next
+                accepted += 1
+
+        _after_epoch(epoch, temp, [(curr, f_curr)], callback, checkpoint, checkpoint_every, log_us)
+        yield _record(epoch + 1, temp, [(curr, f_curr)], accepted)
+
+
+class Journaled(tp.Protocol):
+    def begin(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+J = tp.TypeVar('J', bound=Journaled)
+
+
+def iterate_inplace(
+    curr: J, f_curr: float, temp: float, f: Metric[J], A: tp.Callable[[J], tp.Any],
+    log_u: float | None = None, observe: MoveObserver | None = None,
+) -> tuple[float, bool]:
     """
+    :param curr: current iteration element, mutated in place: J
+    :param f_curr: metric on current iteration element: float
+    :param temp: float > 0
+    :param f: metric to minimize: J -> float
+    :param A: in place operator: J -> Any
+    :param log_u, observe: see `iterate_anneal`
+    :return: metric on the next iteration element and whether the change was accepted
+    """
+    curr.begin()
+    A(curr)
+    f_next = f(curr)
+
+    accepted = accept(f_curr, f_next, temp, _log_uniform() if log_u is None else log_u)
+    if observe is not None:
+        observe(f_next - f_curr, accepted)
+    if accepted:
+        curr.commit()
+        return f_next, True
+    curr.rollback()
+    return f_curr, False
+
+
+def anneal_inplace(
+    init: J,
+    temp_it: tp.Iterator[float],
+    f: Metric[J],
+    A: tp.Callable[[J, int], tp.Any] | Proposer[J],
+    *,
+    sweep: int = 1,
+    start_epoch: int = 0,
+    checkpoint: EpochCallback[J] | None = None,
+    checkpoint_every: int = 1000,
+    callback: EpochCallback[J] | None = None,
+) -> tp.Iterator[EpochRecord]:
+    """
+    Same as `anneal`, but `A` mutates x in place, while x journals the
+    changes (see `lib.solution.Journaled`). Rejected changes are rolled back,
+    accepted are committed, so no neighbours are allocated and no diff tree
+    is grown.
+
+    :param init: initial iteration element, mutated in place: J
+    :param temp_it: iterator over temperatures, Iterator[float > 0]
+    :param f: metric to minimize: J -> float
+    :param A: in place operator: (J, epoch) -> Any, or `Proposer`, which
+        applies moves in place, then nothing is journaled
+    :param sweep, start_epoch, checkpoint, checkpoint_every, callback: see
+        `anneal`
+    :return: stream of epoch records, see `anneal`
+    """
+    assert sweep > 0
     curr, f_curr = init, f(init)
-    history = [(curr, f_curr)]
-    for epoch, temp in enumerate(temp_it):
-        curr, f_curr = iterate_anneal(curr, f_curr, temp, f, lambda x: A(x, epoch))
+    log_us, observe = LogUniforms(), _move_observer(temp_it)
+    yield _record(start_epoch, math.nan, [(curr, f_curr)], 0)
+    for epoch, temp in _epochs(temp_it, start_epoch):
+        accepted = 0
+        for i in range(sweep):
+            if _is_proposer(A):
+                curr, f_curr, moved = iterate_proposal(curr, f_curr, temp, f, A, epoch, log_us.draw(), observe)
+            else:
+                f_curr, moved = iterate_inplace(curr, f_curr, temp, f, lambda x: A(x, epoch), log_us.draw(), observe)
+            accepted += moved
 
-        single = optimize([(curr, f_curr)])
-        assert len(single) == 1
-        curr, f_curr = single[0]
-        
-        history.append((curr, f_curr))
-    return history
+        _after_epoch(epoch, temp, [(curr, f_curr)], callback, checkpoint, checkpoint_every, log_us)
+        yield _record(epoch + 1, temp, [(curr, f_curr)], accepted)
 
 
 def keep_best(currs: list, n: int) -> list:
@@ -83,24 +371,62 @@ def keep_best(currs: list, n: int) -> list:
     return result
 
 
-def anneal_beamsearch(init: X, temp_it: tp.Iterator[float], f: Metric[X], A: Neighbour[X], size: int=2) -> X:
+def next_beam(currs: list, nexts: list, size: int) -> list:
+    """
+    `keep_best` of `nexts`, releasing the rest and the previous beam `currs`.
+    Each entry of `currs` and `nexts` holds a reference.
+    """
+    beam = keep_best(nexts, n=size)
+    for next, _f_next in beam:
+        _hold(next)
+    for x, _f in [*nexts, *currs]:
+        _release(x)
+    return beam
+
+
+def anneal_beamsearch(
+    init: X,
+    temp_it: tp.Iterator[float],
+    f: Metric[X],
+    A: Neighbour[X] | Proposer[X],
+    size: int=2,
+    *,
+    beam: list[X] | None = None,
+    start_epoch: int = 0,
+    checkpoint: EpochCallback[X] | None = None,
+    checkpoint_every: int = 1000,
+    callback: EpochCallback[X] | None = None,
+) -> tp.Iterator[EpochRecord]:
     """
-    :param init: initial iteration element: X
+    :param init: initial iteration element, see `anneal`: X
     :param temp_it: iterator over temperatures, Iterator[float > 0]
     :param f: metric to minimize: X -> float
-    :param A: operator: X -> X
+    :param A: operator: X -> X, or `Proposer`
     :param size: size of beam search
-    :return: history of [(x, f(x))] * size
+    :param beam: beam to resume from instead of copies of `init`, the anneal
+        takes over their references
+    :param start_epoch, checkpoint, checkpoint_every, callback: see `anneal`
+    :return: stream of epoch records with metrics of the beam, see `anneal`
     """
-    currs = [(init, f(init)) for i in range(size)]
-    history = [currs]
-    for epoch, temp in enumerate(temp_it):
-        nexts = []
+    if beam is None:
+        currs = [(init, f(init)) for i in range(size)]
+        for i in range(size - 1):
+            _hold(init)
+    else:
+        currs = [(curr, f(curr)) for curr in beam]
+    log_us, observe = LogUniforms(), _move_observer(temp_it)
+    yield _record(start_epoch, math.nan, currs, 0)
+    for epoch, temp in _epochs(temp_it, start_epoch):
+        nexts, accepted = [], 0
         for curr, f_curr in currs:
-            nexts += [iterate_anneal(curr, f_curr, temp, f, lambda x: A(x, epoch))
-                      for i in range(size)]
-        
-        currs = keep_best(nexts, n=size)
-        currs = optimize(currs)
-        history.append(currs)
-    return history
+            for i in range(size):
+                next, f_next = _iterate(curr, f_curr, temp, f, A, epoch, log_us.draw(), observe)
+                nexts.append((next, f_next))
+                if next is curr:
+                    _hold(curr)
+                else:
+                    accepted += 1
+
+        currs = next_beam(currs, nexts, size)
+        _after_epoch(epoch, temp, currs, callback, checkpoint, checkpoint_every, log_us)
+        yield _record(epoch + 1, temp, currs, accepted)
@@ -0,0 +1,129 @@
+"""
+Parallel version of `lib.anneal.anneal_beamsearch`. Worker processes hold
+a replica of the beam's root solution and expand beam members into
+neighbours, but send back only the accepted moves (see
+`lib.solution.TMove`), which the driver applies to its beam as new diffs.
+Then `next_beam` is done by the driver as usual, and the net changes of the
+root (made by collapsing the diff tree) are broadcast to the replicas.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import random
+import typing as tp
+
+import numpy as np
+
+from lib.anneal import EpochCallback, EpochRecord, Metric, Neighbour, Proposer, next_beam, _iterate, _move_observer, _record
+from lib.solution import Solution, ArraySolution, SolutionDiff, TMove, apply_move
+from lib.workers import workers
+
+
+def _get_root_move(solution: Solution | ArraySolution | SolutionDiff) -> TMove:
+    if isinstance(solution, SolutionDiff):
+        return solution.get_root_move()
+    return (), ()
+
+
+def _expander(conn, root: Solution | ArraySolution, f: Metric, A: Neighbour | Proposer, size: int) -> None:
+    """
+    Worker loop: receives (root move, jobs, temp, epoch), where job is
+    (member's root move, f(member), seed). Sends back `size` pairs (accepted
+    move or `None` for rejected neighbour, `f_next - f_curr` or `None`) per
+    job. `None` stops the worker.
+    """
+    while (message := conn.recv()) is not None:
+        root_move, jobs, temp, epoch = message
+        apply_move(root, root_move)
+
+        results = []
+        for member_move, f_curr, seed in jobs:
+            random.seed(seed)
+            curr = root.diff()
+            apply_move(curr, member_move)
+            moves = []
+            for i in range(size):
+                deltas = []
+                next, _f_next = _iterate(
+                    curr, f_curr, temp, f, A, epoch, None, lambda delta, _accepted: deltas.append(delta),
+                )
+                # no delta, if there was no move to propose
+                delta = deltas[0] if deltas else None
+                if next is curr:
+                    moves.append((None, delta))
+                else:
+                    moves.append((next.get_move(), delta))
+                    next.release()
+            curr.release()
+            results.append(moves)
+        conn.send(results)
+    conn.close()
+
+
+def anneal_beamsearch_parallel(
+    init: Solution | ArraySolution,
+    temp_it: tp.Iterator[float],
+    f: Metric,
+    A: Neighbour | Proposer,
+    size: int=2,
+    *,
+    processes: int | None = None,
+    seed: int | None = None,
+    callback: EpochCallback | None = None,
+) -> tp.Iterator[EpochRecord]:
+    """
+    Same as `anneal_beamsearch`, but `init` must be a root solution and `A`
+    must return a diff of its argument (`Proposer` must apply moves to a
+    diff of its argument).
+
+    :param processes: number of worker processes, all cores if None
+    :param seed: seeds neighbours' generation, fresh entropy if None. Result
+        does not depend on `processes`.
+    :param callback: see `anneal`
+    :return: stream of epoch records, see `anneal_beamsearch`
+
+    See `lib.workers` on pickling of `init`, `f` and `A`.
+    """
+
+    processes = min(processes or os.cpu_count() or 1, size)
+    rng = random.Random(np.random.SeedSequence(seed).generate_state(1).item())
+
+    currs = [(init, f(init)) for i in range(size)]
+    for i in range(size - 1):
+        init.hold()
+    root_move, observe = ((), ()), _move_observer(temp_it)
+    # also stopped when the stream is not consumed till the end
+    with workers(_expander, [(init, f, A, size)] * processes) as conns:
+        yield _record(0, math.nan, currs, 0)
+        for epoch, temp in enumerate(temp_it):
+            # member i is expanded by worker i % processes
+            jobs = [(_get_root_move(curr), f_curr, rng.getrandbits(64)) for curr, f_curr in currs]
+            for worker, conn in enumerate(conns):
+                conn.send((root_move, jobs[worker::processes], temp, epoch))
+            results = [None] * len(jobs)
+            for worker, conn in enumerate(conns):
+                results[worker::processes] = conn.recv()
+
+            nexts, accepted = [], 0
+            for (curr, f_curr), moves in zip(currs, results):
+                for move, delta in moves:
+                    if observe is not None and delta is not None:
+                        observe(delta, move is not None)
+                    if move is None:
+                        curr.hold()
+                        nexts.append((curr, f_curr))
+                    else:
+                        next = curr.diff()
+                        apply_move(next, move)
+                        nexts.append((next, f(next)))
+                        accepted += 1
+
+            init.begin()
+            currs = next_beam(currs, nexts, size)
+            root_move = init.get_journal_move()
+            init.commit()
+            if callback is not None:
+                callback(epoch + 1, temp, currs)
+            yield _record(epoch + 1, temp, currs, accepted)
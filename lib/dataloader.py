@@ -1,12 +1,40 @@
+import os
+import pickle
+import typing as tp
 import pandas as pd
 from pathlib import Path
-from collections import Counter
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
-from ast import literal_eval
+from lib.task import Task
+from lib.trace import from_df as trace_from_df
 
 
 DEBUG = False
 
+CACHE_FILENAME = '.parsed.pkl'
+# bump, once the cached frames change, so old caches are not used
+CACHE_VERSION = 1
+
+# quoted string without escapes, and flat list of them
+_QUOTED = r"'[^'\\]*'" r'|"[^"\\]*"'
+_LIST_OF_QUOTED = rf"""\s*\[\s*(?:(?:{_QUOTED})(?:\s*,\s*(?:{_QUOTED}))*\s*,?)?\s*\]\s*"""
+
+
+def parse_lists(column: pd.Series) -> pd.Series:
+    """
+    Vectorized `ast.literal_eval` for a column of flat lists of quoted
+    strings, e.g. "['a', 'b']". Returns column of tuples. Raises
+    `ValueError` on anything else (e.g. malformed lists, escapes or
+    non-strings), so no customer is silently dropped.
+    """
+
+    valid = column.str.fullmatch(_LIST_OF_QUOTED).fillna(False).astype(bool)
+    if not valid.all():
+        raise ValueError(f"not a list of quoted strings: {column[~valid].iloc[0]!r}")
+    return column.str.findall(_QUOTED).map(lambda items: tuple(item[1:-1] for item in items))
+
 
 def dict_wrap(trace, routes):
     """
@@ -14,16 +42,15 @@ def dict_wrap(trace, routes):
     For given `routes` converts 'claim_segment_uuid_list' to tuple, drops_duplicates
     """
 
-    result = {'trace': trace.copy(deep=True), 'routes': routes.copy(deep=True)}
-
-    result['trace'].chosen_for_proposition_flg = trace.chosen_for_proposition_flg.apply(lambda f : bool(f))
-    
-    result['routes'].claim_segment_uuid_list = routes.claim_segment_uuid_list.apply(lambda l : tuple(literal_eval(l)))
+    result = {
+        'trace': trace.assign(chosen_for_proposition_flg=trace.chosen_for_proposition_flg.astype(bool)),
+        'routes': routes.assign(claim_segment_uuid_list=parse_lists(routes.claim_segment_uuid_list)),
+    }
     result['routes'].drop_duplicates(inplace=True)
 
     if DEBUG:
-        route_ids = trace[trace.chosen_for_proposition_flg].route_id
-        candidates_by_route = {row.route_id: set(row.claim_segment_uuid_list) for _, row in routes.iterrows()}
+        route_ids = result['trace'][result['trace'].chosen_for_proposition_flg].route_id
+        candidates_by_route = {row.route_id: set(row.claim_segment_uuid_list) for _, row in result['routes'].iterrows()}
 
         counter = Counter()
         for route_id in route_ids:
@@ -33,29 +60,205 @@ def dict_wrap(trace, routes):
     return result
 
 
-def load_data(path, wrap=dict_wrap):
-    data = {}
+def _cache_key(path: Path) -> tuple:
+    stats = [(path / filename).stat() for filename in ['trace.csv', 'routes.csv']]
+    return (CACHE_VERSION, *((stat.st_size, stat.st_mtime_ns) for stat in stats))
 
-    for path in list(Path(path).iterdir()):
-        data[path.name] = wrap(
-            trace=pd.read_csv(path / 'trace.csv', index_col=0),
-            routes=pd.read_csv(path / 'routes.csv', index_col=0),
-        )
-    
-    return data
 
+def _read_dir(path: Path, cache: bool) -> dict[str, pd.DataFrame]:
+    """ csv files of the directory as read by pandas, see `load_dir` on `cache` """
+    cache_path = path / CACHE_FILENAME
 
-def load_synthetic(path, wrap=dict_wrap):
-    data = {}
+    if cache:
+        key = _cache_key(path)
+        try:
+            with open(cache_path, 'rb') as handle:
+                cached_key, frames = pickle.load(handle)
+            if cached_key == key:
+                return frames
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError):
+            # missing, corrupted or outdated cache
+            pass
+
+    frames = {
+        'trace': pd.read_csv(path / 'trace.csv', index_col=0),
+        'routes': pd.read_csv(path / 'routes.csv', index_col=0),
+    }
+
+    if cache:
+        # write and rename, so concurrent loaders never see partial cache
+        tmp_path = cache_path.with_name(f'{CACHE_FILENAME}.{os.getpid()}')
+        try:
+            with open(tmp_path, 'wb') as handle:
+                pickle.dump((key, frames), handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # read-only dataset is fine, just no cache
+            pass
+
+    return frames
+
+
+def load_dir(path, wrap=dict_wrap, cache: bool=True):
+    """
+    Loads single trace directory with 'trace.csv' and 'routes.csv'.
+
+    If `cache` is set, the frames read from csv are pickled into
+    `path / CACHE_FILENAME` and reused while both csv files keep their sizes
+    and mtimes. `wrap` is run on every load, so its results (e.g. `Task`s)
+    never outlive library changes.
+    """
+
+    return wrap(**_read_dir(Path(path), cache))
+
+
+def _picklable(obj) -> bool:
+    try:
+        pickle.dumps(obj)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _load_dir_job(args):
+    path, wrap, cache = args
+    return load_dir(path, wrap=wrap, cache=cache)
+
+
+def load_data(path, wrap=dict_wrap, *, cache: bool=True, processes: int | None=None):
+    """
+    Loads every trace directory in `path`, see `load_dir`.
+
+    Directories are parsed by a pool of `processes` (all cores by default),
+    `processes=1` loads serially in the current process, and so does any
+    `wrap`, which can't be pickled for the pool (e.g. lambda).
+    """
+
+    paths = sorted(path for path in Path(path).iterdir() if path.is_dir())
+    jobs = [(path, wrap, cache) for path in paths]
+
+    if processes == 1 or len(paths) <= 1 or not _picklable(wrap):
+        loaded = map(_load_dir_job, jobs)
+        return {path.name: data for path, data in zip(paths, loaded)}
 
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        chunksize = max(1, len(jobs) // (4 * processes))
+        loaded = executor.map(_load_dir_job, jobs, chunksize=chunksize)
+        return {path.name: data for path, data in zip(paths, loaded)}
+
+
+def _wrap_synthetic(trace_entry: pd.DataFrame, wrap):
+    return wrap(
+        trace=trace_entry[['candidate_id', 'route_id', 'chosen_for_proposition_flg', 'score']],
+        routes=trace_entry[['route_id', 'claim_segment_uuid_list']],
+    )
+
+
+def _count_rows(filename: Path) -> int:
+    """ number of data rows in csv file, without parsing it """
+    lines, last = 0, b'\n'
+    with open(filename, 'rb') as handle:
+        while chunk := handle.read(1 << 20):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # header and missing trailing newline
+    return max(0, lines - 1 + (last != b'\n'))
+
+
+class Dataset(Mapping):
+    """
+    Lazy version of `load_data`: trace directories are discovered up front,
+    but loaded (see `load_dir`) only on access. At most `max_resident`
+    loaded traces are kept, least recently used are evicted first
+    (`max_resident=None` keeps everything).
+
+    `wrap` may build heavier objects, e.g. `task_wrap` builds `Task`. Only
+    the csv frames are cached on disk (see `load_dir`), so they are rebuilt
+    on every load. Beware that evicted and accessed again values are loaded
+    anew, so keep references to values, which state matters (e.g. solved
+    tasks).
+    """
+
+    def __init__(self, path, wrap=dict_wrap, *, max_resident: int | None=64, cache: bool=True) -> None:
+        assert max_resident is None or max_resident > 0
+        self.paths = {path.name: path for path in sorted(Path(path).iterdir()) if path.is_dir()}
+        self.wrap = wrap
+        self.cache = cache
+        self.max_resident = max_resident
+        self.resident: OrderedDict[str, tp.Any] = OrderedDict()
+        self.sizes: dict[str, int] = {}
+
+    def __getitem__(self, name: str):
+        if name in self.resident:
+            self.resident.move_to_end(name)
+            return self.resident[name]
+
+        value = load_dir(self.paths[name], wrap=self.wrap, cache=self.cache)
+        self.resident[name] = value
+        if self.max_resident is not None and len(self.resident) > self.max_resident:
+            self.resident.popitem(last=False)
+        return value
+
+    def __iter__(self) -> tp.Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def size(self, name: str) -> int:
+        """ number of rows in trace.csv, counted without parsing """
+        if name not in self.sizes:
+            self.sizes[name] = _count_rows(self.paths[name] / 'trace.csv')
+        return self.sizes[name]
+
+    def sorted_by_size(self, *, min_size: int=0) -> list[str]:
+        names = [name for name in self if self.size(name) >= min_size]
+        return sorted(names, key=self.size)
+
+
+def task_wrap(trace, routes):
+    """ `Dataset`/`load_data` wrap, which builds `Task` right away """
+    data = dict_wrap(trace=trace, routes=routes)
+    return Task(trace_from_df(data['trace'], data['routes']))
+
+
+def load_synthetic(path, wrap=dict_wrap):
     csv = pd.read_csv(path)
     csv.rename(columns={'assigned_flg': 'chosen_for_proposition_flg'}, inplace=True)
 
-    for trace_id in csv.trace_id.unique():
-        trace_entry = csv[csv.trace_id == trace_id]
-        data[trace_id] = wrap(
-            trace=trace_entry[['candidate_id', 'route_id', 'chosen_for_proposition_flg', 'score']],
-            routes=trace_entry[['route_id', 'claim_segment_uuid_list']],
-        )
+    return {
+        trace_id: _wrap_synthetic(trace_entry, wrap)
+        for trace_id, trace_entry in csv.groupby('trace_id', sort=False)
+    }
+
+
+def iter_synthetic(path, wrap=dict_wrap, *, chunksize: int=100_000) -> tp.Iterator[tuple[tp.Any, dict]]:
+    """
+    Streaming version of `load_synthetic`, reads csv by `chunksize` rows and
+    yields `(trace_id, wrapped)` as soon as trace's rows are over. Rows of a
+    single trace must be contiguous in the csv, which holds for generated
+    files. Memory is bounded by chunk plus the biggest trace.
+    """
+
+    seen = set()
+    def complete(frame: pd.DataFrame):
+        for trace_id, trace_entry in frame.groupby('trace_id', sort=False):
+            if trace_id in seen:
+                raise ValueError(f"rows of trace {trace_id} are not contiguous in {path}")
+            seen.add(trace_id)
+            yield trace_id, _wrap_synthetic(trace_entry, wrap)
+
+    pending = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk.rename(columns={'assigned_flg': 'chosen_for_proposition_flg'}, inplace=True)
+        if pending is not None:
+            chunk = pd.concat([pending, chunk])
+
+        # last trace of the chunk may continue in the next one
+        is_last = (chunk.trace_id == chunk.trace_id.iloc[-1]).to_numpy()
+        yield from complete(chunk[~is_last])
+        pending = chunk[is_last]
 
-    return data
+    if pending is not None:
+        yield from complete(pending)
@@ -68,6 +68,39 @@ class DictWithRandomChoice(tp.Generic[TKey, TValue]):
         return key in self.index_map
 
 
+class AliasTable:
+    """
+    Walker's alias method: after O(n) preprocessing samples index `i` with
+    probability proportional to `weights[i]` in O(1), using single random
+    number per sample. Unlike `random.choices` nothing is recomputed per call.
+    """
+
+    def __init__(self, weights: tp.Sequence[float]) -> None:
+        n = len(weights)
+        total = sum(weights)
+        assert n > 0 and total > 0, "total of weights must be greater than zero"
+
+        self.n = n
+        self.prob: list[float] = [weight * n / total for weight in weights]
+        self.alias: list[TIndex] = list(range(n))
+
+        small = [i for i, prob in enumerate(self.prob) if prob < 1]
+        large = [i for i, prob in enumerate(self.prob) if prob >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.alias[less] = more
+            self.prob[more] -= 1 - self.prob[less]
+            (small if self.prob[more] < 1 else large).append(more)
+        # leftovers are 1 up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1
+
+    def sample(self) -> TIndex:
+        u = random.random() * self.n
+        index = int(u)
+        return index if u - index < self.prob[index] else self.alias[index]
+
+
 # TODO better typing
 class SequenceInterface:
     """
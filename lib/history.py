@@ -0,0 +1,65 @@
+"""
+What to retain of the anneal functions' streams of `EpochRecord`s. Records
+are tiny, but a long run yields one per epoch, so one may keep all of them,
+every n-th, or only the summary, which all of the classes below track.
+"""
+
+from __future__ import annotations
+
+import typing as tp
+
+from lib.anneal import EpochRecord
+
+
+class History:
+    """
+    Keeps every record.
+
+    - `epochs` is the number of epochs consumed (the initial record excluded)
+    - `accepted` is the number of neighbours accepted over them
+    - `best` is the record with the least metric, `last` is the last one
+    """
+
+    def __init__(self) -> None:
+        self.records: list[EpochRecord] = []
+        self.epochs = 0
+        self.accepted = 0
+        self.best: EpochRecord | None = None
+        self.last: EpochRecord | None = None
+
+    def keep(self, record: EpochRecord) -> bool:
+        return True
+
+    def append(self, record: EpochRecord) -> None:
+        if self.last is not None:
+            self.epochs += 1
+        self.accepted += record.accepted
+        if self.best is None or record.f < self.best.f:
+            self.best = record
+        self.last = record
+        if self.keep(record):
+            self.records.append(record)
+
+    def consume(self, stream: tp.Iterable[EpochRecord]) -> History:
+        for record in stream:
+            self.append(record)
+        return self
+
+
+class DownsampledHistory(History):
+    """ keeps records of every `every`-th epoch, the initial one included """
+
+    def __init__(self, every: int) -> None:
+        assert every > 0
+        super().__init__()
+        self.every = every
+
+    def keep(self, record: EpochRecord) -> bool:
+        return self.epochs % self.every == 0
+
+
+class SummaryHistory(History):
+    """ keeps no records, only the summary """
+
+    def keep(self, record: EpochRecord) -> bool:
+        return False
@@ -1,6 +1,19 @@
+"""
+On-disk trace format is a directory of `.npy` files, one per `TraceArrays`
+field plus `yandex_score.npy` (files of unset optional fields are missing).
+Arrays are opened with `numpy.memmap`, so loading is zero-copy and workers
+opening the same trace share pages via OS cache. Python structures of the
+trace are materialized lazily, on first access (see `Trace`).
+"""
+
 import pickle
+from dataclasses import fields
 from pathlib import Path
-from lib.trace import Trace
+
+import numpy as np
+
+from lib.trace import Trace, TraceArrays
+
 
 def save(obj, filename):
     with open(filename, 'wb') as handle:
@@ -10,15 +23,39 @@ def load(filename):
     with open(filename, 'rb') as handle:
         return pickle.load(handle)
 
+def _storable(array: np.ndarray) -> np.ndarray:
+    # object arrays (e.g. pandas keys) cannot be memory mapped
+    if array.dtype == object:
+        array = np.array(array.tolist())
+    assert array.dtype != object, "keys must be either all numbers, or all strings"
+    return array
+
 def save_trace(trace: Trace, dir):
     path = Path(dir)
     path.mkdir(parents=True, exist_ok=True)
-    save(trace.candidates, path / "candidates")
-    save(trace.customers_by_route, path / "routes")
+    for field in fields(TraceArrays):
+        filename, array = path / f"{field.name}.npy", getattr(trace.arrays, field.name)
+        if array is None:
+            filename.unlink(missing_ok=True)
+        else:
+            np.save(filename, _storable(array))
+    np.save(path / "yandex_score.npy", np.array(trace.yandex_score))
 
-def load_trace(dir) -> Trace:
+def load_trace(dir, *, mmap: bool = True, bitsets: bool = False) -> Trace:
     path = Path(dir)
-    return Trace(
-        candidates=load(path / "candidates"),
-        customers_by_route=load(path / "routes"),
-    )
+
+    if (path / "candidates").exists():
+        # legacy pickled format
+        return Trace(
+            candidates=load(path / "candidates"),
+            customers_by_route=load(path / "routes"),
+            bitsets=bitsets,
+        )
+
+    mmap_mode = 'r' if mmap else None
+    arrays = TraceArrays(**{
+        field.name: np.load(path / f"{field.name}.npy", mmap_mode=mmap_mode)
+        for field in fields(TraceArrays)
+        if (path / f"{field.name}.npy").exists()
+    })
+    return Trace.from_arrays(arrays, yandex_score=np.load(path / "yandex_score.npy").item(), bitsets=bitsets)
@@ -1,7 +1,19 @@
 from lib.solution import Solution
+from lib.mut.util import TProposal, proposing
 
 
 class IMutation:
+    """
+    Simple mutations may also have (not defined here, so that subclasses,
+    which don't, are told apart by `hasattr`)
+
+        propose(solution, epoch) -> TProposal | None
+
+    move (see `lib.solution.TMove`), which the mutation would make, and the
+    score delta of it, without changing the solution, so rejected moves cost
+    no diff. None if there is no move. See `proposing`.
+    """
+
     def __call__(self, solution: Solution, epoch: int) -> bool:
         pass
 
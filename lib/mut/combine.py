@@ -21,6 +21,15 @@ def conditional(
             if isinstance(mutation_on_false, bool):
                 return mutation_on_false
             return mutation_on_false(solution, epoch)
+
+    if hasattr(mutation_on_true, 'propose') and (isinstance(mutation_on_false, bool) or hasattr(mutation_on_false, 'propose')):
+        def propose(solution: Solution, epoch: int):
+            if epoch_predicat(epoch):
+                return mutation_on_true.propose(solution, epoch)
+            if isinstance(mutation_on_false, bool):
+                return None
+            return mutation_on_false.propose(solution, epoch)
+        impl.propose = propose
     return impl
 
 
@@ -54,7 +63,18 @@ def randomize(
     else:
         weights = np.cumsum(np.array(weights))
 
+    weights = weights.tolist()
+
+    # same as `concat(...)` of the picked ones, but nothing is built per call
     def impl(solution, epoch) -> bool:
-        mutation = concat(*random.choices(mutations, cum_weights=weights, k=k))
-        return mutation(solution, epoch)
+        for mutation in random.choices(mutations, cum_weights=weights, k=k):
+            mutation(solution, epoch)
+        return True
+
+    # picked moves are applied one after another, so only single one can be proposed
+    if k == 1 and all(hasattr(mutation, 'propose') for mutation in mutations):
+        def propose(solution, epoch):
+            mutation, = random.choices(mutations, cum_weights=weights, k=1)
+            return mutation.propose(solution, epoch)
+        impl.propose = propose
     return impl
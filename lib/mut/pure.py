@@ -1,41 +1,55 @@
-import numpy as np
-import random
+import typing as tp
 
-from lib.mut.util import _try_make_busy, _try_make_busy_greedy
+from lib.mut.util import TProposal, proposing, _apply_proposal, _propose_make_busy, _try_make_busy_greedy
 from lib.solution import Solution
 from lib.trace import TCandidateKey, TRouteKey, TCustomerKey
 
 
-def TryMakeBusyRandomCandidateWithRandomRoute(
-        solution: Solution, epoch: int) -> bool:
-    
+def _propose_busy_random_route(solution: Solution, epoch: int) -> TProposal | None:
     if solution.get_idle_candidates_count() == 0:
-        return False
+        return None
 
     candidate, _route = solution.get_random_idle_candidate()
-    route, _score = random.choices(solution.trace.candidates_linear[candidate], weights=solution.trace.sorted_scores[candidate])[0]
-    return _try_make_busy(solution, candidate, route)
+    index = solution.trace.get_route_sampler(candidate).sample()
+    route, _score = solution.trace.candidates_linear[candidate][index]
+    return _propose_make_busy(solution, candidate, route)
 
 
-def TryMakeBusyRandomCandidateWithGreedyRoute(
+@proposing(_propose_busy_random_route)
+def TryMakeBusyRandomCandidateWithRandomRoute(
         solution: Solution, epoch: int) -> bool:
+    return _apply_proposal(solution, _propose_busy_random_route(solution, epoch))
+
 
+def _propose_busy_greedy_route(solution: Solution, epoch: int) -> TProposal | None:
     if solution.get_idle_candidates_count() == 0:
-        return False
+        return None
 
     candidate, _route = solution.get_random_idle_candidate()
-    return _try_make_busy_greedy(solution, candidate)
+    for route, _score in solution.trace.candidates_linear[candidate]:
+        if (proposal := _propose_make_busy(solution, candidate, route)) is not None:
+            return proposal
+    return None
 
 
-def TryMakeIdleRandomCandidate(
+@proposing(_propose_busy_greedy_route)
+def TryMakeBusyRandomCandidateWithGreedyRoute(
         solution: Solution, epoch: int) -> bool:
-    
+    return _apply_proposal(solution, _propose_busy_greedy_route(solution, epoch))
+
+
+def _propose_idle(solution: Solution, epoch: int) -> TProposal | None:
     if solution.get_busy_candidates_count() == 0:
-        return
+        return None
+
+    candidate, route = solution.get_random_busy_candidate()
+    return ((candidate,), ()), -solution.trace.candidates[candidate][route]
 
-    candidate, _route = solution.get_random_busy_candidate()
-    solution.make_idle(candidate)
-    return True
+
+@proposing(_propose_idle)
+def TryMakeIdleRandomCandidate(
+        solution: Solution, epoch: int) -> bool:
+    return _apply_proposal(solution, _propose_idle(solution, epoch))
 
 
 def TryMakeBusyAnyCandidateWithGreedyRoute(
@@ -61,8 +75,7 @@ def MakeRoomForRandomCandidate(
         solution: Solution, epoch: int) -> bool:
     
     candidate, _route = solution.get_random_candidate()
-    room = set().union(*(solution.trace.customers_by_route[route] for route in solution.trace.candidates[candidate]))
-    room = solution.customer_overlap(room)
+    room = solution.customer_overlap(solution.trace.candidate_customers[candidate])
     for candidate in solution.get_candidates_on_customers(room):
         solution.make_idle(candidate)
     return True
@@ -70,38 +83,26 @@ def MakeRoomForRandomCandidate(
 
 
 class FlipBase:
-    def try_random_pick(self, candidate, solution, overlap: set):
+    """
+    `overlap` is a predicate telling whether the given route can't be picked
+    """
+
+    def try_random_pick(self, candidate, solution, overlap: tp.Callable[[TRouteKey], bool]):
         routes_n_scores = solution.trace.candidates_linear[candidate]
-        _, scores = zip(*routes_n_scores) # TODO preprocess
-        cum_weights = self.softmax(scores, for_choices=True)
+        sampler = solution.trace.get_route_sampler(candidate, self.temperature)
         for retry in range(self.random_pick_retries):
-            route, score = random.choices(routes_n_scores, cum_weights=cum_weights, k=1)[0]
-            if not overlap(solution.trace.customers_by_route[route]):
+            route, score = routes_n_scores[sampler.sample()]
+            if not overlap(route):
                 return route
         return None
 
-    def try_determined_pick(self, candidate, solution, overlap: set):
+    def try_determined_pick(self, candidate, solution, overlap: tp.Callable[[TRouteKey], bool]):
         routes_n_scores = solution.trace.candidates_linear[candidate]
         for route, score in sorted(routes_n_scores, key=lambda rns: rns[1], reverse=True):
-            if not overlap(solution.trace.customers_by_route[route]):
+            if not overlap(route):
                 return route
         return None
 
-    def softmax(self, x, for_choices=False):
-        """
-        :param x:
-        :param temperature:
-        
-        note that:
-            t -> +inf => softmax -> np.arange(n) / n
-            t -> 0 => softmax -> (0, .. 1, .. 0) with 1 at pos argmax()
-        """
-        result = np.array(x) - max(x) # hack to deal with overflow
-        result = np.exp(result / self.temperature)
-        if for_choices:
-            return np.cumsum(result)
-        return result / result.sum()
-    
 
 class Flip(FlipBase):
     def __init__(self, temperature: float=1, random_pick_retries: int=5) -> None:
@@ -109,30 +110,46 @@ class Flip(FlipBase):
         self.random_pick_retries = random_pick_retries
 
     def __call__(self, solution: Solution, epoch: int) -> bool:
+        return _apply_proposal(solution, self.propose(solution, epoch))
+
+    def propose(self, solution: Solution, epoch: int) -> TProposal | None:
         if solution.get_busy_candidates_count() == 0:
-            return False
+            return None
 
-        candidate, _route = solution.get_random_busy_candidate()
+        candidate, old_route = solution.get_random_busy_candidate()
 
-        route = None
-        route = route or self.try_random_pick(candidate, solution, solution.customer_overlap)
-        route = route or self.try_determined_pick(candidate, solution, solution.customer_overlap)
+        # route ids are ints, so 0 is a valid route
+        route = self.try_random_pick(candidate, solution, solution.has_route_overlap)
+        if route is None:
+            route = self.try_determined_pick(candidate, solution, solution.has_route_overlap)
         if route is None:
-            return False
+            return None
 
-        solution.make_idle(candidate)
-        solution.make_busy(candidate, route)
-        return True
+        scores = solution.trace.candidates[candidate]
+        return ((), ((candidate, route),)), scores[route] - scores[old_route]
 
 
 class FlippityFlop(FlipBase):
-    def __init__(self, limit: int, temperature: float=1, random_pick_retries: int=5) -> None:
+    """
+    With `route_conflicts=True` routes, which conflict with already fixed ones,
+    are taken from `Trace.route_conflicts` graph (built on first use), so
+    each check is O(1) instead of intersecting customer sets.
+    """
+
+    def __init__(self, limit: int, temperature: float=1, random_pick_retries: int=5, route_conflicts: bool=False) -> None:
         self.limit = limit
         self.temperature = temperature
         self.random_pick_retries = random_pick_retries
+        self.route_conflicts = route_conflicts
     
     def __call__(self, solution: Solution, epoch: int) -> bool:
         fixed_customers = set()
+        blocked_routes = set()
+        def overlap(route: TRouteKey) -> bool:
+            if self.route_conflicts:
+                return route in blocked_routes
+            return not fixed_customers.isdisjoint(solution.trace.customers_by_route[route])
+
         candidate, route = solution.get_random_candidate()
         if route is not None:
             solution.make_idle(candidate)
@@ -145,9 +162,9 @@ class FlippityFlop(FlipBase):
             candidate = q[i]
             assert candidate not in q[:i]
 
-            route = None
-            route = route or self.try_random_pick(candidate, solution, lambda c: c & fixed_customers)
-            route = route or self.try_determined_pick(candidate, solution, lambda c: c & fixed_customers)
+            route = self.try_random_pick(candidate, solution, overlap)
+            if route is None:
+                route = self.try_determined_pick(candidate, solution, overlap)
             if route is None:
                 continue
 
@@ -157,4 +174,9 @@ class FlippityFlop(FlipBase):
                 solution.make_idle(busy_candidate)
                 q.append(busy_candidate)
             solution.make_busy(candidate, route)
-            fixed_customers |= solution.trace.customers_by_route[route]
+            if self.route_conflicts:
+                blocked_routes.update(solution.trace.route_conflicts[route])
+                if solution.trace.customers_by_route[route]:
+                    blocked_routes.add(route)
+            else:
+                fixed_customers |= solution.trace.customers_by_route[route]
@@ -1,10 +1,38 @@
-from lib.solution import Solution
+import typing as tp
+
+from lib.solution import Solution, TMove, apply_move
 from lib.trace import TCandidateKey, TRouteKey, TCustomerKey
 
 
+# move and its score delta, see `IMutation.propose`
+TProposal = tuple[TMove, float]
+
+
+def proposing(propose: tp.Callable[[Solution, int], TProposal | None]):
+    """ decorator, which attaches `propose` to the mutation, see `IMutation.propose` """
+    def decorator(mutation):
+        mutation.propose = propose
+        return mutation
+    return decorator
+
+
+def _apply_proposal(solution: Solution, proposal: TProposal | None) -> bool:
+    if proposal is None:
+        return False
+    move, _delta = proposal
+    apply_move(solution, move)
+    return True
+
+
+def _propose_make_busy(solution: Solution, candidate: TCandidateKey, route: TRouteKey) -> TProposal | None:
+    if solution.has_route_overlap(route):
+        return None
+    return ((), ((candidate, route),)), solution.trace.candidates[candidate][route]
+
+
+
 def _try_make_busy(solution: Solution, candidate: TCandidateKey, route: TRouteKey) -> bool:
-    route_customers = solution.trace.customers_by_route[route]
-    if not solution.customer_overlap(route_customers):
+    if not solution.has_route_overlap(route):
         solution.make_busy(candidate, route)
         return True
     return False
@@ -67,6 +67,11 @@ def optimize_tree(tree, root):
                 grandchildren = tree.get(id(child), [])
                 for grandchild in grandchildren:
                     grandchild.parent = parent
+                    if hasattr(grandchild, '_children'):
+                        # keep `lib.solution.Collapsible` bookkeeping in sync
+                        del child._children[id(grandchild)]
+                        parent._children[id(grandchild)] = grandchild
+                        grandchild._ancestors = None
                 tree[id(parent)] = grandchildren
                 next_layer.append(parent)
 
@@ -106,6 +111,10 @@ def optimize(solutions):
     will have common history at some point and we cannot callapse such trees,
     because it will invalidate other solutions.
 
+    NOTE anneal functions do not rebuild the tree anymore, it's collapsed as
+    solutions are released (see `lib.solution.Collapsible`). Relinked
+    solutions stay releasable, merged ones must not be used.
+
     BRIEF ALGO EXPLANATION
     - Build a tree. Will be done new-to-old, since we have access only to 
         newest solutions. 
@@ -0,0 +1,188 @@
+"""
+Compact snapshots of annealing runs, so long runs can be checkpointed and
+resumed (see `lib.anneal` `checkpoint` parameters and `AnnealSolver`).
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import random
+import typing as tp
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from lib.solution import Solution, ArraySolution, SolutionDiff
+from lib.trace import Trace, TCandidateKey, TRouteKey
+
+
+@dataclass
+class Snapshot:
+    """
+    State of an annealing run after `epoch` epochs: solutions (single one
+    or the beam) as interned ids, `random` module state and the temperature
+    of the last epoch.
+
+    Row `i` of `candidates` lists all candidates in the pool order of the
+    i-th solution, busy ones first, and row `i` of `routes` has their routes
+    (-1 for idle). Single restored solution repeats the pools, hence the
+    random picks of the original run too. Beam is restored as diffs of a
+    common root (so the diff tree collapses as usual), which repeat only the
+    assignments.
+    """
+
+    candidates: np.ndarray
+    routes: np.ndarray
+    scores: np.ndarray
+    epoch: int
+    temperature: float
+    rng_state: tuple
+
+    @staticmethod
+    def take(solutions: tp.Sequence[Solution | ArraySolution | SolutionDiff], *, epoch: int, temperature: float) -> Snapshot:
+        """ O(candidates) per solution """
+        candidates, routes = [], []
+        for solution in solutions:
+            busy = list(solution.iter_candidates(busy=True))
+            idle = [candidate for candidate, _route in solution.iter_candidates(busy=False)]
+            candidates.append([candidate for candidate, _route in busy] + idle)
+            routes.append([route for _candidate, route in busy] + [-1] * len(idle))
+        return Snapshot(
+            candidates=np.array(candidates, dtype=np.int64).reshape(len(solutions), -1),
+            routes=np.array(routes, dtype=np.int64).reshape(len(solutions), -1),
+            scores=np.array([solution.get_score() for solution in solutions], dtype=np.float64),
+            epoch=epoch,
+            temperature=temperature,
+            rng_state=random.getstate(),
+        )
+
+    def rollback(self, journal: list[tuple[TCandidateKey, TRouteKey | None]], score: float) -> None:
+        """
+        Undoes changes of the single solution by its undo-journal entries
+        (see `lib.solution.Journaled`), `score` is the one of the solution
+        after that. O(candidates), pools of the restored solution keep the
+        order of the taken one, not the busy-first one.
+        """
+        assert len(self.candidates) == 1
+        index = {candidate: i for i, candidate in enumerate(self.candidates[0].tolist())}
+        for candidate, undo_route in reversed(journal):
+            self.routes[0, index[candidate]] = -1 if undo_route is None else undo_route
+        self.scores[0] = score
+
+    def restore(self, trace: Trace, solution_type: type[Solution] | type[ArraySolution] = Solution) -> list:
+        """ does not touch `random`, see `restore_random` """
+        assignments = [
+            ({candidate: route for candidate, route in zip(candidates, routes) if route != -1},
+             [candidate for candidate, route in zip(candidates, routes) if route == -1])
+            for candidates, routes in zip(self.candidates.tolist(), self.routes.tolist())
+        ]
+        assignment, idle_order = assignments[0]
+        root = solution_type.from_assignment(trace, assignment, idle_order)
+        if len(assignments) == 1:
+            return [root]
+        beam = [_diff_to(root, assignment) for assignment, _idle_order in assignments]
+        root.release()
+        return beam
+
+    def restore_random(self) -> None:
+        random.setstate(self.rng_state)
+
+    def save(self, path) -> None:
+        """ written atomically, so a run killed while saving keeps the previous snapshot """
+        path = Path(path)
+        version, internal, gauss_next = self.rng_state
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}')
+        with open(tmp_path, 'wb') as handle:
+            np.savez(
+                handle,
+                candidates=self.candidates,
+                routes=self.routes,
+                scores=self.scores,
+                epoch=self.epoch,
+                temperature=self.temperature,
+                rng_version=version,
+                rng_internal=np.array(internal, dtype=np.int64),
+                rng_gauss_next=math.nan if gauss_next is None else gauss_next,
+            )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path) -> Snapshot:
+        with np.load(path) as data:
+            gauss_next = data['rng_gauss_next'].item()
+            return Snapshot(
+                candidates=data['candidates'],
+                routes=data['routes'],
+                scores=data['scores'],
+                epoch=data['epoch'].item(),
+                temperature=data['temperature'].item(),
+                rng_state=(
+                    data['rng_version'].item(),
+                    tuple(data['rng_internal'].tolist()),
+                    None if math.isnan(gauss_next) else gauss_next,
+                ),
+            )
+
+
+class BestSnapshot:
+    """
+    Epoch callback (see `lib.anneal.EpochCallback`), which keeps the best
+    solution seen so far in `best` (after `stop`, if the run goes on).
+    Records are frequent early in a run,
+    while snapshots are O(candidates), so a record only marks the position
+    in the root's `trail` (see `lib.solution.Journaled`) and keeps the
+    changes of the best member relative to the root. The snapshot is taken
+    once the trail outgrows the candidates (so the cost is amortized O(1)
+    per change) or on `stop`, by rolling the current root back to the mark.
+    Random state of the snapshot is the one of the time it is taken.
+    """
+
+    def __init__(self) -> None:
+        self.best_f = math.inf
+        self.root = None
+        self.best: Snapshot | None = None
+        # (epoch, temp, trail position, root move, score) of not yet taken record
+        self.record: tuple | None = None
+
+    def __call__(self, epoch: int, temp: float, currs: list[tuple[tp.Any, float]]) -> None:
+        curr, f_curr = min(currs, key=lambda item: item[1])
+        if f_curr < self.best_f:
+            root, move = (curr.root, curr.get_root_move()) if isinstance(curr, SolutionDiff) else (curr, ((), ()))
+            if root is not self.root:
+                self.stop()
+                self.root, root.trail = root, []
+            self.best_f = f_curr
+            self.record = epoch, temp, len(root.trail), move, curr.get_score()
+        if self.root is not None and len(self.root.trail) > self.root.trace.candidates_count:
+            self._take()
+            self.root.trail.clear()
+
+    def _take(self) -> None:
+        if self.record is None:
+            return
+        epoch, temp, position, (idle, busy), score = self.record
+        self.best = Snapshot.take([self.root], epoch=epoch, temperature=temp)
+        # entries are undone last to first, so the member's move goes after the root's changes
+        move = [*busy, *((candidate, None) for candidate in idle)]
+        self.best.rollback([*move, *self.root.trail[position:]], score)
+        self.record = None
+
+    def stop(self) -> None:
+        """ takes the pending record and stops trailing the root """
+        self._take()
+        if self.root is not None:
+            self.root.trail = None
+            self.root = None
+
+
+def _diff_to(root, assignment: dict[TCandidateKey, TRouteKey]) -> SolutionDiff:
+    diff = root.diff()
+    for candidate, route in list(root.iter_candidates(busy=True)):
+        if assignment.get(candidate) != route:
+            diff.make_idle(candidate)
+    for candidate, route in assignment.items():
+        if diff.get_route(candidate) is None:
+            diff.make_busy(candidate, route)
+    return diff
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field
 import random
 from copy import deepcopy
 import typing as tp
@@ -12,8 +13,112 @@ from lib.funny import DictWithRandomChoice, SequenceInterface, StackedSequences,
 DEBUG = False
 
 
+# compact description of changes: candidates to make idle, then pairs
+# (candidate, route) to make busy, see `apply_move`
+TMove = tuple[tuple[TCandidateKey, ...], tuple[tuple[TCandidateKey, TRouteKey], ...]]
+
+
+def apply_move(solution, move: TMove) -> None:
+    """ busy candidates of the move may be busy in `solution` with another route """
+    idle, busy = move
+    for candidate in idle:
+        solution.make_idle(candidate)
+    for candidate, _route in busy:
+        if solution.get_route(candidate) is not None:
+            solution.make_idle(candidate)
+    for candidate, route in busy:
+        solution.make_busy(candidate, route)
+
+
+class Journaled:
+    """
+    Undo-journal for in-place mutations of root solutions: changes made
+    between `begin()` and `rollback()` are undone by replaying inverse
+    operations. `commit()` just drops the journal.
+
+    Unless None, `trail` gets undo entries of every change, rolled back ones
+    included, regardless of the journal, e.g. see `lib.snapshot.BestSnapshot`.
+    """
+
+    def _journal(self, candidate: TCandidateKey, undo_route: TRouteKey | None) -> None:
+        """ records how to undo: make busy with `undo_route`, or make idle if None """
+        if self.journal is not None:
+            self.journal.append((candidate, undo_route))
+        if self.trail is not None:
+            self.trail.append((candidate, undo_route))
+
+    def begin(self) -> None:
+        assert self.journal is None, "nested journals are not supported"
+        self.journal = []
+        self.journal_score = self.score
+
+    def commit(self) -> None:
+        self.journal = None
+
+    def get_journal_move(self) -> TMove:
+        """ net changes since `begin()` """
+        initial = {}
+        for candidate, undo_route in self.journal:
+            initial.setdefault(candidate, undo_route)
+        changed = [
+            (candidate, route, self.get_route(candidate))
+            for candidate, route in initial.items()
+            if self.get_route(candidate) != route
+        ]
+        return (
+            tuple(candidate for candidate, _route, new_route in changed if new_route is None),
+            tuple((candidate, new_route) for candidate, _route, new_route in changed if new_route is not None),
+        )
+
+    def rollback(self) -> None:
+        journal, self.journal = self.journal, None
+        for candidate, undo_route in reversed(journal):
+            if undo_route is None:
+                self.make_idle(candidate)
+            else:
+                self.make_busy(candidate, undo_route)
+        # avoid float drift
+        self.score = self.journal_score
+
+
+class Collapsible:
+    """
+    Live diff tree bookkeeping, so the tree is collapsed incrementally
+    instead of `lib.optimize` rebuilds. `_refs` counts holders of a solution
+    (solutions are created held once, by their creator), `_children` has
+    its live diffs by id. Once released solution has no holders and:
+    - no children, it is dropped from its parent (diffs only)
+    - single child, the two merge: a diff is folded into the child, the root
+      applies the child, which becomes an empty diff
+    so held solutions stay valid, while solutions with no holders may be
+    mutated (root) or invalidated (diffs).
+    """
+
+    def hold(self) -> None:
+        self._refs += 1
+
+    def release(self) -> None:
+        assert self._refs > 0, "solution is not held"
+        self._refs -= 1
+        node = self
+        while node is not None and node._refs == 0 and len(node._children) <= 1:
+            node = node._collapse()
+
+    def unwrap(self) -> Collapsible:
+        """ equivalent solution, which takes over the hold of self, see `SolutionDiff.unwrap` """
+        return self
+
+    def _collapse(self) -> Collapsible | None:
+        """ merges with the single child if any, returns node to check next """
+        if self._children:
+            child, = self._children.values()
+            apply_move(self, child.get_move())
+            child._reset()
+        return None
+
+
 @dataclass
-class Solution:
+class Solution(Journaled, Collapsible):
     idle_candidates: DictWithRandomChoice[TCandidateKey, None]
     busy_candidates: DictWithRandomChoice[TCandidateKey, TRouteKey]
     used_customers: dict[TCustomerKey, TCandidateKey]
@@ -21,30 +126,68 @@ class Solution:
 
     trace: Trace
 
+    # bitmask of used customers, maintained only if `trace.customer_masks` is present
+    used_mask: int = 0
+
+    journal: list[tuple[TCandidateKey, TRouteKey | None]] | None = None
+    trail: list[tuple[TCandidateKey, TRouteKey | None]] | None = field(default=None, repr=False, compare=False)
+
+    # incremented on every change, so diffs can tell their root has changed
+    version: int = 0
+
+    _refs: int = field(default=1, init=False, repr=False, compare=False)
+    _children: dict[int, SolutionDiff] = field(default_factory=dict, init=False, repr=False, compare=False)
+
     @staticmethod
     def empty(trace: Trace) -> Solution:
         return Solution(
-            idle_candidates=DictWithRandomChoice.fromkeys(trace.candidates.keys()),
+            idle_candidates=DictWithRandomChoice.fromkeys(range(len(trace.candidates))),
             busy_candidates=DictWithRandomChoice(),
             used_customers=dict(),
             score=0,
             trace=trace,
         )
 
+    @staticmethod
+    def from_assignment(
+        trace: Trace,
+        assignment: tp.Mapping[TCandidateKey, TRouteKey],
+        idle_order: tp.Sequence[TCandidateKey] | None = None,
+    ) -> Solution:
+        """
+        E.g. `trace.baseline`. Busy candidates are pooled in the order of
+        `assignment`, idle ones in `idle_order` if given, so random picks of
+        a restored solution repeat the ones of the original (see `lib.snapshot`).
+        """
+        solution = _assign(Solution.empty(trace), assignment)
+        if idle_order is not None:
+            assert solution.idle_candidates.index_map.keys() == set(idle_order), "idle_order must list idle candidates"
+            solution.idle_candidates = DictWithRandomChoice.fromkeys(idle_order)
+        return solution
+
     def make_busy(self, candidate: TCandidateKey, route: TRouteKey) -> None:
         if DEBUG:
             assert len(self.customer_overlap(self.trace.customers_by_route[route])) == 0
         self.idle_candidates.remove(candidate)
         self.busy_candidates.add(candidate, route)
+        self._journal(candidate, None)
+        self.version += 1
         self.used_customers |= dict.fromkeys(self.trace.customers_by_route[route], candidate)
+        if self.trace.customer_masks is not None:
+            self.used_mask |= self.trace.customer_masks[route]
         self.score += self.trace.candidates[candidate][route]
 
     def make_idle(self, candidate: TCandidateKey) -> None:
         route = self.busy_candidates[candidate]
         self.idle_candidates.add(candidate, None)
         self.busy_candidates.remove(candidate)
+        self._journal(candidate, route)
+        self.version += 1
         for customer in self.trace.customers_by_route[route]:
             self.used_customers.pop(customer)
+        if self.trace.customer_masks is not None:
+            # all route's customers are used by the candidate, so xor clears them
+            self.used_mask ^= self.trace.customer_masks[route]
         self.score -= self.trace.candidates[candidate][route]
 
     def get_idle_candidates_count(self) -> int:
@@ -58,12 +201,10 @@ class Solution:
         return self.busy_candidates.get_random_item()
 
     def get_random_candidate(self) -> tuple[TCandidateKey, TRouteKey | None]:
-        choice = random.choices(
-            [self.get_random_idle_candidate, self.get_random_busy_candidate],
-            weights=[self.get_idle_candidates_count(), self.get_busy_candidates_count()],
-            k=1,
-        )[0]
-        return choice()
+        idle_count = self.get_idle_candidates_count()
+        if random.random() * (idle_count + self.get_busy_candidates_count()) < idle_count:
+            return self.get_random_idle_candidate()
+        return self.get_random_busy_candidate()
 
     def _get_candidates_sequence_interface(self, *, busy: bool | None=None):
         if busy is None:
@@ -78,6 +219,11 @@ class Solution:
     def customer_overlap(self, customers) -> set[TCustomerKey]:
         return self.used_customers.keys() & customers
 
+    def has_route_overlap(self, route: TRouteKey) -> bool:
+        if self.trace.customer_masks is not None:
+            return bool(self.used_mask & self.trace.customer_masks[route])
+        return not self.used_customers.keys().isdisjoint(self.trace.customers_by_route[route])
+
     def get_score(self) -> float:
         return self.score
     
@@ -92,6 +238,7 @@ class Solution:
             unused_customers=set(),
             score=self.score,
             trace=self.trace,
+            used_mask=self.used_mask,
         )
     
     def get_route(self, candidate) -> TRouteKey | None:
@@ -116,7 +263,191 @@ class Solution:
 
     def validate(self) -> None:
         score = 0
-        used_customers = dict[TCustomerKey, TCandidateKey]
+        used_customers = dict[TCustomerKey, TCandidateKey]()
+        for candidate, route in self.iter_candidates():
+            if route is None:
+                continue
+
+            route_customers = self.trace.customers_by_route[route]
+            overlap = used_customers.keys() & route_customers
+            assert not overlap, "got overlapping customers"
+            used_customers |= dict.fromkeys(route_customers, candidate)
+
+            score += self.trace.candidates[candidate][route]
+        assert score == self.get_score()
+
+
+class ArraySolution(Journaled, Collapsible):
+    """
+    Drop-in replacement of `Solution` backed by preallocated int buffers:
+    - `routes[candidate]` is candidate's route or -1 if idle
+    - `owners[customer]` is customer's candidate or -1 if unused
+    - `pool` holds busy candidates first (`pool[:busy_count]`) then idle ones,
+      `positions[candidate]` is candidate's index in `pool`, so moving
+      candidate between busy and idle is a single swap.
+
+    State changes do not allocate, and memory is a few machine words per
+    candidate and customer.
+    """
+
+    def __init__(self, trace: Trace) -> None:
+        candidates_count = trace.candidates_count
+        self.trace = trace
+        self.routes = array('q', [-1]) * candidates_count
+        self.owners = array('q', [-1]) * trace.customers_count
+        self.pool = array('q', range(candidates_count))
+        self.positions = array('q', range(candidates_count))
+        self.busy_count = 0
+        self.score = 0
+        self.used_mask = 0
+        self.journal = None
+        self.trail = None
+        self.version = 0
+        self._refs = 1
+        self._children = {}
+
+    @staticmethod
+    def empty(trace: Trace) -> ArraySolution:
+        return ArraySolution(trace)
+
+    @staticmethod
+    def from_assignment(
+        trace: Trace,
+        assignment: tp.Mapping[TCandidateKey, TRouteKey],
+        idle_order: tp.Sequence[TCandidateKey] | None = None,
+    ) -> ArraySolution:
+        """ see `Solution.from_assignment` """
+        solution = _assign(ArraySolution(trace), assignment)
+        if idle_order is not None:
+            assert sorted(solution.pool[solution.busy_count:]) == sorted(idle_order), "idle_order must list idle candidates"
+            for index, candidate in enumerate(idle_order, solution.busy_count):
+                solution.pool[index] = candidate
+                solution.positions[candidate] = index
+        return solution
+
+    def _swap(self, candidate: TCandidateKey, index: int) -> None:
+        """ moves `candidate` to `pool[index]` """
+        pool, positions = self.pool, self.positions
+        other, position = pool[index], positions[candidate]
+        pool[index], pool[position] = candidate, other
+        positions[candidate], positions[other] = index, position
+
+    def make_busy(self, candidate: TCandidateKey, route: TRouteKey) -> None:
+        if DEBUG:
+            assert not self.has_route_overlap(route)
+        assert self.routes[candidate] == -1, f"candidate {candidate} is already busy"
+        self._swap(candidate, self.busy_count)
+        self.busy_count += 1
+        self.routes[candidate] = route
+        self._journal(candidate, None)
+        self.version += 1
+        owners = self.owners
+        for customer in self.trace.customers_by_route[route]:
+            owners[customer] = candidate
+        if self.trace.customer_masks is not None:
+            self.used_mask |= self.trace.customer_masks[route]
+        self.score += self.trace.candidates[candidate][route]
+
+    def make_idle(self, candidate: TCandidateKey) -> None:
+        route = self.routes[candidate]
+        assert route != -1, f"candidate {candidate} is already idle"
+        self.busy_count -= 1
+        self._swap(candidate, self.busy_count)
+        self.routes[candidate] = -1
+        self._journal(candidate, route)
+        self.version += 1
+        owners = self.owners
+        for customer in self.trace.customers_by_route[route]:
+            owners[customer] = -1
+        if self.trace.customer_masks is not None:
+            self.used_mask ^= self.trace.customer_masks[route]
+        self.score -= self.trace.candidates[candidate][route]
+
+    def get_idle_candidates_count(self) -> int:
+        return len(self.pool) - self.busy_count
+    def get_random_idle_candidate(self) -> tuple[TCandidateKey, None]:
+        if self.busy_count == len(self.pool):
+            return None
+        return self.pool[self.busy_count + int(random.random() * (len(self.pool) - self.busy_count))], None
+
+    def get_busy_candidates_count(self) -> int:
+        return self.busy_count
+    def get_random_busy_candidate(self) -> tuple[TCandidateKey, TRouteKey]:
+        if self.busy_count == 0:
+            return None
+        candidate = self.pool[int(random.random() * self.busy_count)]
+        return candidate, self.routes[candidate]
+
+    def get_random_candidate(self) -> tuple[TCandidateKey, TRouteKey | None]:
+        candidate = self.pool[int(random.random() * len(self.pool))]
+        return candidate, self.get_route(candidate)
+
+    def _get_candidates_sequence_interface(self, *, busy: bool | None=None):
+        begin, end = {None: (0, len(self.pool)), True: (0, self.busy_count), False: (self.busy_count, len(self.pool))}[busy]
+        def getitem(index):
+            if index < 0:
+                index += end - begin
+            candidate = self.pool[begin + index]
+            return candidate, self.get_route(candidate)
+        return SequenceInterface(getitem, lambda: end - begin)
+
+    def iter_candidates(self, *, busy: bool | None=None, shuffle: bool=False):
+        candidates = self._get_candidates_sequence_interface(busy=busy)
+        return shuffled_sequence(candidates) if shuffle else iter(candidates)
+
+    def customer_overlap(self, customers) -> set[TCustomerKey]:
+        owners = self.owners
+        return {customer for customer in customers if owners[customer] != -1}
+
+    def has_route_overlap(self, route: TRouteKey) -> bool:
+        if self.trace.customer_masks is not None:
+            return bool(self.used_mask & self.trace.customer_masks[route])
+        owners = self.owners
+        for customer in self.trace.customers_by_route[route]:
+            if owners[customer] != -1:
+                return True
+        return False
+
+    def get_score(self) -> float:
+        return self.score
+
+    def diff(self) -> SolutionDiff:
+        return SolutionDiff(
+            parent=self,
+            idle_candidates=DictWithRandomChoice(),
+            busy_candidates=DictWithRandomChoice(),
+            busy_candidates_count=self.busy_count,
+            used_customers=dict(),
+            unused_customers=set(),
+            score=self.score,
+            trace=self.trace,
+            used_mask=self.used_mask,
+        )
+
+    def get_route(self, candidate) -> TRouteKey | None:
+        route = self.routes[candidate]
+        return None if route == -1 else route
+
+    def get_candidates_on_customers(self, customers: tp.Iterable[TCustomerKey]) -> set[TCandidateKey]:
+        result = set()
+        for customer in customers:
+            candidate = self.owners[customer]
+            assert candidate != -1, f"customer {customer} is unused"
+            result.add(candidate)
+        return result
+
+    # DEBUG
+    def dump(self):
+        return "INIT", dict(
+            idle_candidates={candidate: None for candidate in self.pool[self.busy_count:]},
+            busy_candidates={candidate: self.routes[candidate] for candidate in self.pool[:self.busy_count]},
+            used_customers={customer: owner for customer, owner in enumerate(self.owners) if owner != -1},
+            score=self.get_score(),
+        )
+
+    def validate(self) -> None:
+        score = 0
+        used_customers = dict[TCustomerKey, TCandidateKey]()
         for candidate, route in self.iter_candidates():
             if route is None:
                 continue
@@ -128,6 +459,15 @@ class Solution:
 
             score += self.trace.candidates[candidate][route]
         assert score == self.get_score()
+        assert used_customers == self.dump()[1]['used_customers']
+
+
+def _assign(solution, assignment: tp.Mapping[TCandidateKey, TRouteKey]):
+    for candidate, route in assignment.items():
+        assert route in solution.trace.candidates[candidate], f"route {route} is not candidate's {candidate} one"
+        assert not solution.has_route_overlap(route), f"route {route} of candidate {candidate} overlaps"
+        solution.make_busy(candidate, route)
+    return solution
 
 
 class SkipNoneIterator:
@@ -145,7 +485,26 @@ class SkipNoneIterator:
 
 
 @dataclass
-class SolutionDiff:
+class SolutionDiff(Collapsible):
+    """
+    Patch over `parent`. Fields hold changes relative to the parent, while
+    lookups of unchanged state go straight to the `root` solution through
+    `_ancestors` overlay: all changes of the ancestor diffs flattened into two
+    dicts (candidate -> route, customer -> candidate, `None` for idle and
+    unused respectively). The overlay is built once, on the first lookup, so
+    lookups are O(1) regardless of the depth.
+
+    The overlay stays valid, since ancestors are mutated only by merges with
+    their single child (see `Collapsible` and `lib.optimize`), which keep the
+    state of all the descendants intact.
+
+    Random idle (busy) candidates are drawn from `_unrooted` pools of
+    candidates, which are idle (busy) here but not in the root, or from the
+    root's pool rejecting candidates, which state differs here. Both are
+    uniform, so the mix weighted by sizes is exactly uniform. Pools are
+    relative to the root, so they are rebuilt once the root changes.
+    """
+
     parent: Solution
 
     idle_candidates: DictWithRandomChoice[TCandidateKey, None]
@@ -157,6 +516,160 @@ class SolutionDiff:
 
     trace: Trace
 
+    # unlike other fields, holds the whole bitmask of used customers (not
+    # relative to the parent), see `Solution.used_mask`
+    used_mask: int = 0
+
+    root: Solution | ArraySolution = field(init=False, repr=False)
+    _ancestors: tuple[dict[TCandidateKey, TRouteKey | None], dict[TCustomerKey, TCandidateKey | None]] | None = \
+        field(default=None, init=False, repr=False)
+    _unrooted: tuple[DictWithRandomChoice[TCandidateKey, None], DictWithRandomChoice[TCandidateKey, TRouteKey]] | None = \
+        field(default=None, init=False, repr=False)
+    _unrooted_version: int = field(default=-1, init=False, repr=False)
+
+    _refs: int = field(default=1, init=False, repr=False, compare=False)
+    _children: dict[int, SolutionDiff] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.root = self.parent.root if isinstance(self.parent, SolutionDiff) else self.parent
+        self.parent._children[id(self)] = self
+
+    def _collapse(self) -> Collapsible:
+        parent = self.parent
+        del parent._children[id(self)]
+        if self._children:
+            child, = self._children.values()
+            child._absorb_parent()
+        return parent
+
+    def unwrap(self) -> Collapsible:
+        """
+        The root, if self is its only, empty and childless diff, and nobody
+        else holds them (e.g. after the root has merged with self), so
+        further diffs are not stacked on an empty one.
+        """
+        parent = self.parent
+        if (
+            parent is self.root and parent._refs == 0 and self._refs == 1 and not self._children
+            and not self.idle_candidates and not self.busy_candidates
+        ):
+            parent.hold()
+            self.release()
+            return parent
+        return self
+
+    def _absorb_parent(self) -> None:
+        """ takes over changes of the parent, so it can be dropped, O(changes of both) """
+        parent = self.parent
+        changed = dict.fromkeys([
+            *parent.idle_candidates.index_map, *parent.busy_candidates.index_map,
+            *self.idle_candidates.index_map, *self.busy_candidates.index_map,
+        ])
+        idle_candidates, busy_candidates = DictWithRandomChoice(), DictWithRandomChoice()
+        for candidate in changed:
+            route = self.get_route(candidate)
+            if route == parent._get_inherited_route(candidate):
+                continue
+            if route is None:
+                idle_candidates.add(candidate, None)
+            else:
+                busy_candidates.add(candidate, route)
+
+        used_customers = {
+            customer: candidate for customer, candidate in parent.used_customers.items()
+            if customer not in self.unused_customers
+        }
+        used_customers |= self.used_customers
+        self.unused_customers = (parent.unused_customers - self.used_customers.keys()) | self.unused_customers
+        self.used_customers = used_customers
+        self.idle_candidates, self.busy_candidates = idle_candidates, busy_candidates
+
+        # the state is the same, so only own overlay is stale
+        self.parent = parent.parent
+        self.parent._children[id(self)] = self
+        self._ancestors = None
+
+    def _reset(self) -> None:
+        """ parent (the root) has applied changes of self, which are dropped """
+        self.idle_candidates, self.busy_candidates = DictWithRandomChoice(), DictWithRandomChoice()
+        self.used_customers, self.unused_customers = dict(), set()
+        self._ancestors = None
+
+    def _get_ancestors(self):
+        if self._ancestors is None:
+            parent = self.parent
+            if parent is self.root:
+                self._ancestors = {}, {}
+            elif not parent.idle_candidates and not parent.busy_candidates and not parent.unused_customers:
+                # nothing to add, overlays are never mutated, so can be shared
+                self._ancestors = parent._get_ancestors()
+            else:
+                routes, owners = parent._get_ancestors()
+                routes, owners = routes.copy(), owners.copy()
+                routes.update(dict.fromkeys(parent.idle_candidates.index_map))
+                routes.update(parent.busy_candidates.elements)
+                owners.update(dict.fromkeys(parent.unused_customers))
+                owners.update(parent.used_customers)
+                self._ancestors = routes, owners
+        return self._ancestors
+
+    def _get_unrooted(self):
+        """ (idle here but busy in root, busy here but idle in root) """
+        if self._unrooted is None or self._unrooted_version != self.root.version:
+            self._unrooted = DictWithRandomChoice(), DictWithRandomChoice()
+            self._unrooted_version = self.root.version
+            routes, _owners = self._get_ancestors()
+            for candidate in routes.keys() | self.idle_candidates.index_map.keys() | self.busy_candidates.index_map.keys():
+                self._update_unrooted(candidate)
+        return self._unrooted
+
+    def _update_unrooted(self, candidate: TCandidateKey) -> None:
+        unrooted_idle, unrooted_busy = self._unrooted
+        if candidate in unrooted_idle:
+            unrooted_idle.remove(candidate)
+        if candidate in unrooted_busy:
+            unrooted_busy.remove(candidate)
+
+        route, root_route = self.get_route(candidate), self.root.get_route(candidate)
+        if route is None and root_route is not None:
+            unrooted_idle.add(candidate, None)
+        elif route is not None and root_route is None:
+            unrooted_busy.add(candidate, route)
+
+    def _get_inherited_route(self, candidate: TCandidateKey) -> TRouteKey | None:
+        """ route in parent """
+        if self.parent is self.root:
+            return self.root.get_route(candidate)
+        routes, _owners = self._get_ancestors()
+        if candidate in routes:
+            return routes[candidate]
+        return self.root.get_route(candidate)
+
+    def _get_inherited_customer_overlap(self, customers) -> set[TCustomerKey]:
+        """ customer_overlap in parent """
+        if self.parent is self.root:
+            return self.root.customer_overlap(customers)
+        _routes, owners = self._get_ancestors()
+        changed = owners.keys() & customers
+        if not changed:
+            return self.root.customer_overlap(customers)
+        return (
+            self.root.customer_overlap(set(customers) - changed)
+            | {customer for customer in changed if owners[customer] is not None}
+        )
+
+    def _get_inherited_candidates_on_customers(self, customers: set[TCustomerKey]) -> set[TCandidateKey]:
+        """ get_candidates_on_customers in parent """
+        if self.parent is self.root:
+            return self.root.get_candidates_on_customers(customers)
+        _routes, owners = self._get_ancestors()
+        changed = owners.keys() & customers
+        result = self.root.get_candidates_on_customers(customers - changed)
+        for customer in changed:
+            assert (candidate := owners[customer]) is not None, f"customer {customer} is unused"
+            result.add(candidate)
+        return result
+
     def make_busy(self, candidate: TCandidateKey, route: TRouteKey) -> None:
         if DEBUG:
             assert len(self.customer_overlap(self.trace.customers_by_route[route])) == 0
@@ -166,14 +679,18 @@ class SolutionDiff:
 
         if candidate in self.idle_candidates:
             self.idle_candidates.remove(candidate)
-            if self.parent.get_route(candidate) != route:
+            if self._get_inherited_route(candidate) != route:
                 self.busy_candidates.add(candidate, route)
         else:
             self.busy_candidates.add(candidate, route)
 
         self.used_customers |= dict.fromkeys(self.trace.customers_by_route[route], candidate)
         self.unused_customers -= self.trace.customers_by_route[route]
+        if self.trace.customer_masks is not None:
+            self.used_mask |= self.trace.customer_masks[route]
         self.score += self.trace.candidates[candidate][route]
+        if self._unrooted is not None:
+            self._update_unrooted(candidate)
 
     def make_idle(self, candidate: TCandidateKey) -> None:
         assert (route := self.get_route(candidate)) is not None
@@ -182,7 +699,7 @@ class SolutionDiff:
 
         if candidate in self.busy_candidates:
             self.busy_candidates.remove(candidate)
-            if self.parent.get_route(candidate) is not None:
+            if self._get_inherited_route(candidate) is not None:
                 self.idle_candidates.add(candidate, None)
         else:
             self.idle_candidates.add(candidate, None)
@@ -191,65 +708,93 @@ class SolutionDiff:
             # ignore missing item, since it can be present only in parent
             # in case of an actual error, the error will be trigger in the apply
             self.used_customers.pop(customer, None)
-        self.unused_customers |= self.parent.customer_overlap(self.trace.customers_by_route[route])
+        self.unused_customers |= self._get_inherited_customer_overlap(self.trace.customers_by_route[route])
+        if self.trace.customer_masks is not None:
+            self.used_mask ^= self.trace.customer_masks[route]
         self.score -= self.trace.candidates[candidate][route]
+        if self._unrooted is not None:
+            self._update_unrooted(candidate)
 
     def get_idle_candidates_count(self) -> int:
         return len(self.trace.candidates) - self.busy_candidates_count
 
     def get_random_idle_candidate(self) -> tuple[TCandidateKey, None]:
-        result = None
-        while result is None:
-            result = random.choice(self._get_candidates_sequence_interface(busy=False))
-        return result
+        """
+        Expected number of draws is `root idle / (root idle - unrooted busy)`,
+        i.e. O(1) while most of the root's idle candidates stay idle.
+        """
+        idle_count = self.get_idle_candidates_count()
+        if idle_count == 0:
+            return None
+        unrooted_idle, _unrooted_busy = self._get_unrooted()
+        if random.random() * idle_count < len(unrooted_idle):
+            return unrooted_idle.get_random_item()
+        while True:
+            candidate, _route = self.root.get_random_idle_candidate()
+            if self.get_route(candidate) is None:
+                return candidate, None
 
     def get_busy_candidates_count(self) -> int:
         return self.busy_candidates_count
 
     def get_random_busy_candidate(self) -> tuple[TCandidateKey, TRouteKey]:
-        result = None
-        while result is None:
-            result = random.choice(self._get_candidates_sequence_interface(busy=True))
-        return result
+        """ see `get_random_idle_candidate` """
+        busy_count = self.get_busy_candidates_count()
+        if busy_count == 0:
+            return None
+        _unrooted_idle, unrooted_busy = self._get_unrooted()
+        if random.random() * busy_count < len(unrooted_busy):
+            return unrooted_busy.get_random_item()
+        while True:
+            candidate, _route = self.root.get_random_busy_candidate()
+            if (route := self.get_route(candidate)) is not None:
+                return candidate, route
 
     def get_random_candidate(self) -> tuple[TCandidateKey, TRouteKey | None]:
-        choice = random.choices(
-            [self.get_random_idle_candidate, self.get_random_busy_candidate],
-            weights=[self.get_idle_candidates_count(), self.get_busy_candidates_count()],
-            k=1,
-        )[0]
-        return choice()
+        idle_count = self.get_idle_candidates_count()
+        if random.random() * (idle_count + self.get_busy_candidates_count()) < idle_count:
+            return self.get_random_idle_candidate()
+        return self.get_random_busy_candidate()
 
     def _get_candidates_sequence_interface(self, *, busy: bool | None=None):
-        parent_candidates = self.parent._get_candidates_sequence_interface(busy=busy)
-        
+        """
+        Root's candidates with the state looked up here (`None` for the ones,
+        which state differs), followed by the `_unrooted` pool. Single level
+        regardless of the depth.
+        """
+        root_candidates = self.root._get_candidates_sequence_interface(busy=busy)
+        get_route = self.get_route
+
+        if busy is None:
+            def getitem(index):
+                candidate, _route = root_candidates[index]
+                return candidate, get_route(candidate)
+            return SequenceInterface(getitem, root_candidates.__len__)
+
         def getitem(index):
-            item = parent_candidates[index]
-            if item is None:
-                return None
-            candidate, route = item
-            if (candidate in self.idle_candidates) or (candidate in self.busy_candidates):
+            candidate, _route = root_candidates[index]
+            route = get_route(candidate)
+            if (route is not None) != busy:
                 return None
             return candidate, route
 
-        if busy is None:
-            return StackedSequences(
-                SequenceInterface(getitem, parent_candidates.__len__),
-                SequenceInterface.from_sequence(self.idle_candidates.elements),
-                SequenceInterface.from_sequence(self.busy_candidates.elements),
-            )
-        else:
-            return StackedSequences(
-                SequenceInterface(getitem, parent_candidates.__len__),
-                SequenceInterface.from_sequence((self.busy_candidates if busy else self.idle_candidates).elements),
-            )
+        unrooted = self._get_unrooted()[1 if busy else 0]
+        return StackedSequences(
+            SequenceInterface(getitem, root_candidates.__len__),
+            SequenceInterface.from_sequence(unrooted.elements),
+        )
 
     def iter_candidates(self, *, busy: bool | None=None, shuffle: bool=False):
         candidates = self._get_candidates_sequence_interface(busy=busy)
         return SkipNoneIterator(shuffled_sequence(candidates) if shuffle else iter(candidates))
 
     def customer_overlap(self, customers) -> set[TCustomerKey]:
-        return (self.parent.customer_overlap(customers) | (self.used_customers.keys() & customers)) - self.unused_customers
+        return (self._get_inherited_customer_overlap(customers) | (self.used_customers.keys() & customers)) - self.unused_customers
+
+    def has_route_overlap(self, route: TRouteKey) -> bool:
+        if self.trace.customer_masks is not None:
+            return bool(self.used_mask & self.trace.customer_masks[route])
+        return bool(self.customer_overlap(self.trace.customers_by_route[route]))
 
     def get_score(self) -> float:
         return self.score
@@ -259,7 +804,7 @@ class SolutionDiff:
             return None
         if candidate in self.busy_candidates:
             return self.busy_candidates[candidate]
-        return self.parent.get_route(candidate)
+        return self._get_inherited_route(candidate)
     
     def diff(self) -> SolutionDiff:
         return SolutionDiff(
@@ -271,8 +816,28 @@ class SolutionDiff:
             unused_customers=set(),
             score=self.score,
             trace=self.trace,
+            used_mask=self.used_mask,
         )
     
+    def get_move(self) -> TMove:
+        """ changes relative to the parent """
+        return tuple(self.idle_candidates.index_map), tuple(self.busy_candidates.elements)
+
+    def get_root_move(self) -> TMove:
+        """ changes relative to the root """
+        routes, _owners = self._get_ancestors()
+        changed = routes.keys() | self.idle_candidates.index_map.keys() | self.busy_candidates.index_map.keys()
+        idle, busy = [], []
+        for candidate in changed:
+            route = self.get_route(candidate)
+            if route == self.root.get_route(candidate):
+                continue
+            if route is None:
+                idle.append(candidate)
+            else:
+                busy.append((candidate, route))
+        return tuple(idle), tuple(busy)
+
     def apply(self) -> Solution:
         """
         Invalidates self. Use returned parent instead.
@@ -280,19 +845,14 @@ class SolutionDiff:
         Be aware that self children will still point to self, even if it
         invalid. You must fix that linkage externally.
         """
-        for candidate, _route in self.idle_candidates:
-            self.parent.make_idle(candidate)
-        for candidate, _route in self.busy_candidates:
-            if self.parent.get_route(candidate) is not None:
-                self.parent.make_idle(candidate)
-        for candidate, route in self.busy_candidates:
-            self.parent.make_busy(candidate, route)
+        apply_move(self.parent, self.get_move())
+        self.parent._children.pop(id(self), None)
         return self.parent
 
     def get_candidates_on_customers(self, customers: set[TCustomerKey]) -> set[TCandidateKey]:
         result = {self.used_customers[customer] for customer in customers & self.used_customers.keys()}
         assert len(customers & self.unused_customers) == 0
-        return result | self.parent.get_candidates_on_customers(customers - self.used_customers.keys())
+        return result | self._get_inherited_candidates_on_customers(customers - self.used_customers.keys())
 
     # DEBUG
     def dump(self):
@@ -306,7 +866,7 @@ class SolutionDiff:
 
     def validate(self) -> None:
         score = 0
-        used_customers = dict[TCustomerKey, TCandidateKey]
+        used_customers = dict[TCustomerKey, TCandidateKey]()
         for candidate, route in self.iter_candidates():
             if route is None:
                 continue
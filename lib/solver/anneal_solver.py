@@ -1,10 +1,36 @@
+import random
 import typing as tp
+from pathlib import Path
 
 from lib.solver.solver import Solver
-from lib.anneal import anneal, anneal_beamsearch
-from lib.solution import Solution
+from lib.anneal import anneal, anneal_beamsearch, anneal_inplace
+from lib.beamsearch import anneal_beamsearch_parallel
+from lib.history import History
+from lib.snapshot import Snapshot, BestSnapshot
+from lib.solution import Solution, ArraySolution, TMove, apply_move
 from lib.task import Task, TaskSolution
-from lib.temperature import TTemperature
+from lib.temperature import TTemperature, Adaptive, Anytime
+
+
+class _MutationProposer:
+    """ `lib.anneal.Proposer` of the mutation's moves (see `IMutation.propose`), metric is `-score` """
+
+    def __init__(self, mutation, inplace: bool) -> None:
+        self.mutation = mutation
+        self.inplace = inplace
+
+    def propose_move(self, solution: Solution, epoch: int) -> tuple[TMove, float] | None:
+        proposal = self.mutation.propose(solution, epoch)
+        if proposal is None:
+            return None
+        move, score_delta = proposal
+        return move, -score_delta
+
+    def apply_move(self, solution: Solution, move: TMove) -> Solution:
+        if not self.inplace:
+            solution = solution.diff()
+        apply_move(solution, move)
+        return solution
 
 
 class AnnealSolver(Solver):
@@ -14,12 +40,66 @@ class AnnealSolver(Solver):
         epoches: int,
         temp: TTemperature,
         beamsearch_size : int | None = None,
+        solution_type: type[Solution] | type[ArraySolution] = Solution,
+        inplace: bool = False,
+        sweep: int | None = 1,
+        warm_start: bool = False,
+        checkpoint: tp.Callable[[Task], str | Path] | None = None,
+        checkpoint_every: int = 1000,
+        beamsearch_processes: int | None = 1,
+        seconds: float | None = None,
+        patience: int | None = None,
+        history: tp.Callable[[], History] = History,
     ) -> None:
+        """
+        :param mutation: if it can `propose` its moves (see `IMutation`),
+            neighbours are made for accepted moves only
+        :param inplace: mutate single solution in place with undo-journal
+            instead of making diffs, see `anneal_inplace`. Not supported by
+            beamsearch.
+        :param sweep: mutations per epoch, see `anneal`; None for one per
+            candidate of the trace. Not supported by beamsearch.
+        :param warm_start: start from the production assignment
+            (`Trace.baseline`) instead of the empty solution
+        :param checkpoint: task -> snapshot file (see `lib.snapshot`), written
+            every `checkpoint_every` epochs. If the file exists, solving
+            resumes from it, and the history starts at the snapshot's epoch.
+            The file is removed once the run is over. Retries of `solve_all`
+            must get own files, e.g. by `task.job` (see `Task.job`). State of
+            `adaptive` schedules is not saved, so they are not supported.
+        :param beamsearch_processes: expand the beam in that many processes
+            (all cores if None), see `anneal_beamsearch_parallel`. Does not
+            support checkpoints.
+        :param seconds: wall-clock budget, the schedule of `epoches`
+            temperatures is stretched over it (see `Anytime`)
+        :param patience: stop once the best score has not improved for that
+            many epochs
+        With either of the two set, the best solution seen is kept in
+        `TaskSolution.solution`.
+        :param history: makes what retains epoch records, e.g.
+            `lambda: DownsampledHistory(100)` or `SummaryHistory`, see
+            `lib.history`. Score histories are filled from retained records.
+        """
+        assert not (inplace and beamsearch_size is not None), "beamsearch cannot be done in place"
+        assert sweep == 1 or beamsearch_size is None, "beamsearch does not sweep"
+        # calibration of the schedule would restart on resume
+        assert checkpoint is None or not isinstance(temp(1), Adaptive), "adaptive schedule does not support checkpoints"
+        assert beamsearch_processes == 1 or checkpoint is None, "parallel beamsearch does not support checkpoints"
         super().__init__()
         self.mutation = mutation
         self.epoches = epoches
         self.temp = temp
         self.beamsearch_size = beamsearch_size
+        self.solution_type = solution_type
+        self.inplace = inplace
+        self.sweep = sweep
+        self.warm_start = warm_start
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.beamsearch_processes = beamsearch_processes
+        self.seconds = seconds
+        self.patience = patience
+        self.history = history
 
     def solve(self, task: Task) -> None:
         def metric(solution: Solution) -> float:
@@ -29,25 +109,70 @@ class AnnealSolver(Solver):
             solution = solution.diff()
             self.mutation(solution, epoch)
             return solution
-        
-        solution = Solution.empty(task.trace)
-        temperature = self.temp(self.epoches)
 
-        task_solution = TaskSolution()
+        mutate_inplace = self.mutation
+        if hasattr(self.mutation, 'propose'):
+            mutate, mutate_inplace = _MutationProposer(self.mutation, inplace=False), _MutationProposer(self.mutation, inplace=True)
         
-        if self.beamsearch_size is None:
-            history = anneal(solution, iter(temperature), metric, mutate)
+        if self.warm_start:
+            solution = self.solution_type.from_assignment(task.trace, task.trace.baseline)
+        else:
+            solution = self.solution_type.empty(task.trace)
+
+        beam, resume = None, dict(checkpoint_every=self.checkpoint_every)
+        if self.checkpoint is not None:
+            path = Path(self.checkpoint(task))
+            snapshot = Snapshot.load(path) if path.exists() else None
+            # snapshot of a finished run (e.g. killed before removing it) is not resumed
+            if snapshot is not None and snapshot.epoch < self.epoches:
+                beam = snapshot.restore(task.trace, self.solution_type)
+                snapshot.restore_random()
+                solution = beam[0]
+                resume['start_epoch'] = snapshot.epoch
+
+            def checkpoint(epoch: int, temp: float, currs: list[tuple[Solution, float]]) -> None:
+                Snapshot.take([curr for curr, _f_curr in currs], epoch=epoch, temperature=temp).save(path)
+            resume['checkpoint'] = checkpoint
 
-            for _curr, f_curr in history:
-                epoch_score = -f_curr
-                task_solution.score_history_all.append([epoch_score])
-                task_solution.score_history.append(epoch_score)
+        callback, best = None, None
+        if self.seconds is None and self.patience is None:
+            temp_it = iter(self.temp(self.epoches))
+        else:
+            temp_it = Anytime(self.temp, self.epoches, seconds=self.seconds, patience=self.patience)
+            best = BestSnapshot()
+            best(resume.get('start_epoch', 0), temp_it.temps[0].item(), [(solution, metric(solution))])
+
+            def callback(epoch: int, temp: float, currs: list[tuple[Solution, float]]) -> None:
+                best(epoch, temp, currs)
+                temp_it.observe(best.best_f)
+
+        if self.beamsearch_size is None:
+            sweep = max(len(task.trace.candidates), 1) if self.sweep is None else self.sweep
+            if self.inplace:
+                stream = anneal_inplace(solution, temp_it, metric, mutate_inplace, sweep=sweep, callback=callback, **resume)
+            else:
+                stream = anneal(solution, temp_it, metric, mutate, sweep=sweep, callback=callback, **resume)
         else:
-            history = anneal_beamsearch(solution, iter(temperature), metric, mutate, size=self.beamsearch_size)
+            if self.beamsearch_processes == 1:
+                stream = anneal_beamsearch(
+                    solution, temp_it, metric, mutate, size=self.beamsearch_size, beam=beam, callback=callback, **resume,
+                )
+            else:
+                stream = anneal_beamsearch_parallel(
+                    solution, temp_it, metric, mutate, size=self.beamsearch_size,
+                    processes=self.beamsearch_processes, seed=random.getrandbits(64), callback=callback,
+                )
 
-            for entry in history:
-                epoch_scores = [-f_curr for _curr, f_curr in entry]
-                task_solution.score_history_all.append(epoch_scores)
-                task_solution.score_history.append(max(epoch_scores))
+        history = self.history().consume(stream)
+        if self.checkpoint is not None:
+            path.unlink(missing_ok=True)
+        task_solution = TaskSolution(best_score=-history.best.f)
+        for record in history.records:
+            epoch_scores = [-f_curr for f_curr in record.fs]
+            task_solution.score_history_all.append(epoch_scores)
+            task_solution.score_history.append(max(epoch_scores))
 
+        if best is not None:
+            best.stop()
+            task_solution.solution = best.best.restore(task.trace, self.solution_type)[0]
         task.task_solutions.append(task_solution)
@@ -1,13 +1,86 @@
-from lib.task import Task
-from lib.fun.iterators import duplicate
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lib.task import Task, TaskSolution
+from lib.trace import Trace
+from lib.workers import fork_context
 
 
 class Solver:
     def solve(self, task: Task) -> None:
         raise NotImplementedError
-    
-    def solve_all(self, *tasks: Task, retries: int=1, tqdm=None) -> None:
-        tasks = tuple(duplicate(tasks, n=retries))
 
-        for task in tasks if tqdm is None else tqdm(tasks):
-            self.solve(task)
+    def solve_seeded(self, trace: Trace, seed: int, job: tuple[int, int] | None = None) -> list[TaskSolution]:
+        """
+        solves a fresh task on `trace` (with `job`, see `Task.job`) with
+        `random` and `numpy.random` seeded by `seed`
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+        task = Task(trace, job=job)
+        self.solve(task)
+        return task.task_solutions
+
+    def solve_all(
+        self,
+        *tasks: Task,
+        retries: int=1,
+        tqdm=None,
+        processes: int | None=1,
+        seed: int | None=None,
+    ) -> None:
+        """
+        Solves every task `retries` times. Each (task, retry) job gets its own
+        seed derived from `seed` (fresh entropy if None), and solutions are
+        appended to `task.task_solutions` in the order of tasks and retries,
+        so results do not depend on `processes`. Note that `solve` gets a
+        fresh `Task` on the task's trace, which `job` tells the retries
+        apart (see `Task.job`). States of `random` and
+        `numpy.random` are left as they were.
+
+        With `processes != 1` jobs run in a pool of processes (all cores if
+        None). Traces are sent to each worker once, at its start, and only
+        `TaskSolution`s are sent back. See `lib.workers` on pickling of the
+        solver (hence mutations).
+        """
+
+        task_jobs = [(task_index, retry) for task_index in range(len(tasks)) for retry in range(retries)]
+        seeds = np.random.SeedSequence(seed).generate_state(len(task_jobs)).tolist()
+        jobs = list(zip(task_jobs, seeds))
+
+        if processes == 1 or len(jobs) <= 1:
+            # jobs reseed the global generators, which are the caller's here
+            random_state, np_random_state = random.getstate(), np.random.get_state()
+            try:
+                for (task_index, retry), job_seed in jobs if tqdm is None else tqdm(jobs):
+                    task = tasks[task_index]
+                    task.task_solutions += self.solve_seeded(task.trace, job_seed, (task_index, retry))
+            finally:
+                random.setstate(random_state)
+                np.random.set_state(np_random_state)
+            return
+
+        processes = min(processes or os.cpu_count() or 1, len(jobs))
+        traces = [task.trace for task in tasks]
+        with ProcessPoolExecutor(processes, fork_context(), initializer=_init_worker, initargs=(self, traces)) as executor:
+            results = executor.map(_solve_job, jobs)
+            for ((task_index, _retry), _job_seed), task_solutions in zip(jobs, results if tqdm is None else tqdm(results, total=len(jobs))):
+                tasks[task_index].task_solutions += task_solutions
+
+
+# per worker process state, see `_init_worker`
+_worker_solver: Solver | None = None
+_worker_traces: list[Trace] | None = None
+
+
+def _init_worker(solver: Solver, traces: list[Trace]) -> None:
+    global _worker_solver, _worker_traces
+    _worker_solver, _worker_traces = solver, traces
+
+
+def _solve_job(job: tuple[tuple[int, int], int]) -> list[TaskSolution]:
+    (task_index, retry), seed = job
+    return _worker_solver.solve_seeded(_worker_traces[task_index], seed, (task_index, retry))
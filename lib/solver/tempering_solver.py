@@ -0,0 +1,63 @@
+import random
+import typing as tp
+
+from lib.solver.solver import Solver
+from lib.solution import Solution, ArraySolution
+from lib.task import Task, TaskSolution
+from lib.tempering import anneal_tempering
+from lib.temperature import TTemperature
+
+
+class TemperingSolver(Solver):
+    def __init__(
+        self,
+        mutation: tp.Callable[[Solution, int], bool],
+        epoches: int,
+        ladder: TTemperature,
+        replicas: int,
+        exchange_every: int = 100,
+        solution_type: type[Solution] | type[ArraySolution] = Solution,
+        warm_start: bool = False,
+    ) -> None:
+        """
+        Parallel tempering, see `lib.tempering`. Every replica runs
+        `epoches` epochs, in its own process.
+
+        :param ladder: temperatures of replicas are `ladder(replicas)`
+        :param warm_start: see `AnnealSolver`
+
+        `score_history` has the best score after each exchange round,
+        `score_history_all` has replicas' scores by temperature, and
+        `solution` is the best solution.
+        """
+        assert epoches % exchange_every == 0, "epoches must be a multiple of exchange_every"
+        super().__init__()
+        self.mutation = mutation
+        self.epoches = epoches
+        self.ladder = ladder
+        self.replicas = replicas
+        self.exchange_every = exchange_every
+        self.solution_type = solution_type
+        self.warm_start = warm_start
+
+    def solve(self, task: Task) -> None:
+        def metric(solution: Solution) -> float:
+            return -solution.get_score()
+
+        if self.warm_start:
+            solution = self.solution_type.from_assignment(task.trace, task.trace.baseline)
+        else:
+            solution = self.solution_type.empty(task.trace)
+
+        result = anneal_tempering(
+            solution, self.ladder(self.replicas), metric, self.mutation,
+            rounds=self.epoches // self.exchange_every, exchange_every=self.exchange_every,
+            seed=random.getrandbits(64),
+        )
+
+        task_solution = TaskSolution(
+            score_history=[-best_f for best_f in result.best_history],
+            score_history_all=[[-f for f in fs] for fs in result.history],
+            solution=result.best.restore(task.trace, self.solution_type)[0],
+        )
+        task.task_solutions.append(task_solution)
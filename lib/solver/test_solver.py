@@ -0,0 +1,189 @@
+import random
+
+import pytest
+
+from lib import mut
+from lib.solver.solver import Solver
+from lib.anneal import anneal, anneal_beamsearch, anneal_inplace
+from lib.solver.anneal_solver import AnnealSolver, _MutationProposer
+from lib.solver.tempering_solver import TemperingSolver
+from lib.solution import Solution, ArraySolution, apply_move
+from lib.task import Task, TaskSolution
+from lib.temperature import adaptive, exponential
+from lib.test_snapshot import random_trace
+
+
+class RandomSolver(Solver):
+    def solve(self, task: Task) -> None:
+        task.task_solutions.append(TaskSolution(score_history=[len(task.trace.candidates), random.random()]))
+
+
+def scores(tasks: list[Task]) -> list[list[list[float]]]:
+    return [[task_solution.score_history for task_solution in task.task_solutions] for task in tasks]
+
+
+def test_solve_all_deterministic():
+    def solve_all(processes, seed):
+        tasks = [Task(random_trace(n)) for n in [3, 1, 2]]
+        RandomSolver().solve_all(*tasks, retries=4, processes=processes, seed=seed)
+        return scores(tasks)
+
+    serial = solve_all(processes=1, seed=0)
+    assert [[size for size, _random in task] for task in serial] == [[3] * 4, [1] * 4, [2] * 4]
+    # every job has own seed
+    assert len({value for task in serial for _size, value in task}) == 12
+
+    assert solve_all(processes=2, seed=0) == serial
+
+    # caller's generators are not reseeded
+    random.seed(42)
+    expected = random.random()
+    random.seed(42)
+    solve_all(processes=1, seed=None)
+    assert random.random() == expected
+    assert solve_all(processes=1, seed=1) != serial
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_anneal_solve_all(processes):
+    tasks = [Task(random_trace(seed=seed)) for seed in range(2)]
+    solver = AnnealSolver(mut.TryMakeBusyRandomCandidateWithGreedyRoute, epoches=50, temp=exponential(10, 1.01))
+    solver.solve_all(*tasks, retries=2, processes=processes, seed=0)
+    assert [len(task.task_solutions) for task in tasks] == [2, 2]
+
+    expected = [Task(task.trace) for task in tasks]
+    solver.solve_all(*expected, retries=2, processes=1, seed=0)
+    assert scores(tasks) == scores(expected)
+
+
+def test_tempering_solver():
+    task = Task(random_trace())
+    solver = TemperingSolver(mut.TryMakeBusyRandomCandidateWithGreedyRoute, epoches=100, ladder=exponential(10, 2.0), replicas=2, exchange_every=50)
+    solver.solve_all(task, seed=0)
+
+    task_solution, = task.task_solutions
+    assert len(task_solution.score_history) == len(task_solution.score_history_all) == 2
+    task_solution.solution.validate()
+    assert task_solution.solution.get_score() == task_solution.get_score()
+
+
+def test_adaptive_unsupported(tmp_path):
+    with pytest.raises(AssertionError):
+        AnnealSolver(mut.TryMakeIdleRandomCandidate, epoches=10, temp=adaptive(), checkpoint=lambda task: tmp_path / 'snapshot')
+    solver = TemperingSolver(mut.TryMakeIdleRandomCandidate, epoches=100, ladder=adaptive(), replicas=2, exchange_every=50)
+    with pytest.raises(AssertionError):
+        solver.solve_all(Task(random_trace()), seed=0)
+
+
+@pytest.mark.parametrize("beamsearch_size", [None, 2])
+def test_anytime_solver(beamsearch_size):
+    task = Task(random_trace())
+    solver = AnnealSolver(
+        mut.randomize(mut.TryMakeBusyRandomCandidateWithGreedyRoute, mut.TryMakeIdleRandomCandidate, k=1),
+        epoches=10**5, temp=exponential(10, 1.0), beamsearch_size=beamsearch_size, patience=20,
+    )
+    solver.solve_all(task, seed=0)
+
+    task_solution, = task.task_solutions
+    assert len(task_solution.score_history) < 10**3
+    task_solution.solution.validate()
+    assert task_solution.solution.get_score() == task_solution.get_score()
+
+    solver = AnnealSolver(mut.TryMakeBusyRandomCandidateWithGreedyRoute, epoches=1000, temp=exponential(10, 1.01), seconds=0.05)
+    solver.solve_all(task, seed=0)
+    task.task_solutions[-1].solution.validate()
+
+
+SIMPLE = [
+    mut.Flip(),
+    mut.TryMakeBusyRandomCandidateWithRandomRoute,
+    mut.TryMakeBusyRandomCandidateWithGreedyRoute,
+    mut.TryMakeIdleRandomCandidate,
+]
+
+
+@pytest.mark.parametrize("inplace", [False, True])
+def test_sweeping_solver(inplace):
+    task = Task(random_trace())
+    solver = AnnealSolver(
+        mut.randomize(*SIMPLE), epoches=20, temp=exponential(10, 1.1), inplace=inplace, sweep=None,
+    )
+    solver.solve_all(task, seed=0)
+
+    task_solution, = task.task_solutions
+    assert len(task_solution.score_history) == 21
+    assert task_solution.get_score() > 0
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_proposals(solution_type):
+    solution = solution_type.empty(random_trace())
+    random.seed(0)
+    for epoch in range(300):
+        mutation = random.choice(SIMPLE)
+        score, state = solution.get_score(), random.getstate()
+        proposed = solution.diff()
+        proposal = mutation.propose(proposed, epoch)
+        assert proposed.get_score() == score
+        proposed.release()
+
+        # the same picks, as both the random state and the diffs are the same
+        random.setstate(state)
+        diff = solution.diff()
+        assert mutation(diff, epoch) == (proposal is not None)
+        if proposal is not None:
+            move, delta = proposal
+            assert diff.get_score() == score + delta
+            apply_move(solution, move)
+            assert solution.get_score() == diff.get_score()
+        diff.release()
+        solution.validate()
+
+
+@pytest.mark.parametrize("mutation", SIMPLE)
+def test_anneal_inplace_mutation(mutation):
+    # mutations' own `propose` is not taken for `lib.anneal.Proposer`
+    random.seed(0)
+    solution = Solution.empty(random_trace())
+    history = list(anneal_inplace(solution, iter([1e-3] * 300), lambda s: -s.get_score(), mutation))
+    solution.validate()
+    assert history[-1].f == -solution.get_score()
+    if mutation is not mut.TryMakeIdleRandomCandidate:
+        assert sum(record.accepted for record in history) > 0
+
+
+def test_mutation_subclass():
+    class Greedy(mut.IMutation):
+        def __call__(self, solution, epoch):
+            return mut.TryMakeBusyRandomCandidateWithGreedyRoute(solution, epoch)
+
+    assert not hasattr(Greedy(), 'propose')
+    task = Task(random_trace())
+    AnnealSolver(Greedy(), epoches=100, temp=exponential(10, 1.01)).solve_all(task, seed=0)
+    assert task.task_solutions[0].get_score() > 0
+
+
+@pytest.mark.parametrize("engine", ["anneal", "inplace", "beamsearch"])
+def test_proposing_anneal(engine):
+    mutation = mut.randomize(*SIMPLE)
+    assert hasattr(mutation, 'propose')
+    proposer = _MutationProposer(mutation, inplace=engine == "inplace")
+
+    def metric(solution) -> float:
+        return -solution.get_score()
+
+    def check(epoch, temp, currs):
+        for curr, f_curr in currs:
+            curr.validate()
+            assert f_curr == metric(curr)
+
+    random.seed(0)
+    init, temps = Solution.empty(random_trace()), iter(exponential(10, 1.01)(300))
+    if engine == "beamsearch":
+        stream = anneal_beamsearch(init, temps, metric, proposer, size=3, callback=check)
+    else:
+        stream = (anneal_inplace if engine == "inplace" else anneal)(init, temps, metric, proposer, callback=check)
+    history = list(stream)
+    assert len(history) == 301
+    assert 0 < sum(record.accepted for record in history) < 300 * (9 if engine == "beamsearch" else 1)
+    assert history[-1].f < -1000
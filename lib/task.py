@@ -12,22 +12,29 @@ class TaskSolution:
     - `score_history_all` contains *all* soluions at each epoch
 
     `score_history_all` makes more sense for beamsearch.
+
+    Both may be downsampled or empty (see `lib.history`), then `best_score`
+    is the best score of the run.
     """
 
     score_history: list[float] = field(default_factory=list)
     score_history_all: list[float] = field(default_factory=list)
-    solution: Solution | None = None # TODO don't invalidate best solution while optimizing (see optimize.py)
+    solution: Solution | None = None # TODO keep the best solution of AnnealSolver without `seconds`/`patience` too
+    best_score: float | None = None
 
     def get_score(self) -> float:
-        assert len(self.score_history) > 0
-        return max(self.score_history)
+        scores = self.score_history if self.best_score is None else [*self.score_history, self.best_score]
+        assert len(scores) > 0
+        return max(scores)
 
 
 @dataclass
 class Task:
     trace: Trace
     task_solutions: list[TaskSolution] = field(default_factory=list)
+    # (task index, retry) of the job in `Solver.solve_all`, which solves this task
+    job: tuple[int, int] | None = None
 
 
-def make_tasks(data: tp.Iterable[dict[str, pd.DataFrame]]):
-    return [Task(trace_from_df(df['trace'], df['routes'])) for df in data]   
+def make_tasks(data: tp.Iterable[dict[str, pd.DataFrame]], **trace_kwargs):
+    return [Task(trace_from_df(df['trace'], df['routes'], **trace_kwargs)) for df in data]
@@ -1,3 +1,5 @@
+import math
+import time
 import typing as tp
 import numpy as np
 
@@ -20,3 +22,144 @@ def exponential(init: float, coefficient: float) -> TTemperature:
         temp = np.power(coefficient, -np.arange(epoches)) * init
         return temp
     return temperature
+
+
+class Adaptive:
+    """
+    Iterator over `epoches` temperatures steered by outcomes of Metropolis
+    tests, which anneal functions pass to `observe_move` (see
+    `lib.anneal.iterate_anneal`), so the scale of the metric does not have to
+    be known beforehand:
+    - the first `warmup` moves are greedy (`floor` temperature), just to
+      sample metric deltas of worsening moves
+    - then a worsening move of the average delta (exponentially weighted by
+      `smoothing`) is accepted with `target` probability, which decays
+      geometrically from `accept_init` to `accept_final` over the epochs
+    - since the acceptance of the average delta is not the average
+      acceptance, the temperature is also scaled by `exp(correction)`, and
+      every worsening move adds `gain * (target - accepted)` to the latter
+    """
+
+    def __init__(
+        self,
+        epoches: int,
+        *,
+        accept_init: float = 0.5,
+        accept_final: float = 0.01,
+        warmup: int = 100,
+        smoothing: float = 0.01,
+        gain: float = 0.01,
+        floor: float = 1e-9,
+    ) -> None:
+        assert 0 < accept_final <= accept_init < 1
+        assert warmup >= 0 and 0 < smoothing <= 1 and gain >= 0 and floor > 0
+        self.epoches = epoches
+        self.accept_init = accept_init
+        self.accept_final = accept_final
+        self.warmup = warmup
+        self.smoothing = smoothing
+        self.gain = gain
+        self.floor = floor
+
+        self.epoch = 0
+        self.moves = 0
+        self.delta = None
+        self.correction = 0.
+        self.target = accept_init
+
+    def observe_move(self, delta: float, accepted: bool) -> None:
+        """ `delta` is the metric (to minimize) of the neighbour minus the current one """
+        self.moves += 1
+        if delta <= 0:
+            # always accepted, tells nothing about the temperature
+            return
+        self.delta = delta if self.delta is None else self.delta + self.smoothing * (delta - self.delta)
+        if self.moves > self.warmup:
+            self.correction += self.gain * (self.target - accepted)
+
+    def get_temp(self) -> float:
+        if self.moves < self.warmup or self.delta is None:
+            return self.floor
+        return max(-self.delta / math.log(self.target) * math.exp(self.correction), self.floor)
+
+    def __iter__(self) -> tp.Iterator[float]:
+        return self
+
+    def __next__(self) -> float:
+        if self.epoch >= self.epoches:
+            raise StopIteration
+        self.target = self.accept_init * (self.accept_final / self.accept_init) ** (self.epoch / self.epoches)
+        self.epoch += 1
+        return self.get_temp()
+
+
+def adaptive(accept_init: float = 0.5, accept_final: float = 0.01, **kwargs) -> TTemperature:
+    """ see `Adaptive` for the rest of the parameters """
+    def temperature(epoches: int) -> Adaptive:
+        return Adaptive(epoches, accept_init=accept_init, accept_final=accept_final, **kwargs)
+    return temperature
+
+
+class Anytime:
+    """
+    Iterator over temperatures of `temp(epoches)` schedule, which may stop
+    early:
+    - with `seconds` set, the schedule is stretched over the wall-clock
+      budget instead of epochs: each epoch takes the temperature at the
+      elapsed fraction of the budget, and iteration stops once the budget is
+      spent, however many epochs it took
+    - with `patience` set, iteration stops once the metric passed to
+      `observe` has not improved for `patience` epochs in a row
+    """
+
+    def __init__(
+        self,
+        temp: TTemperature,
+        epoches: int,
+        *,
+        seconds: float | None = None,
+        patience: int | None = None,
+        clock: tp.Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert seconds is None or seconds > 0
+        assert patience is None or patience > 0
+        schedule = temp(epoches)
+        assert not isinstance(schedule, Adaptive), "adaptive schedule is not precomputed"
+        self.temps = np.asarray(schedule, dtype=np.float64)
+        self.seconds = seconds
+        self.patience = patience
+        self.clock = clock
+
+        self.epoch = 0
+        self.start = None
+        self.best = np.inf
+        self.stale = 0
+
+    def observe(self, f: float) -> None:
+        """ metric (to minimize) after the last epoch """
+        if f < self.best:
+            self.best, self.stale = f, 0
+        else:
+            self.stale += 1
+
+    def __iter__(self) -> tp.Iterator[float]:
+        return self
+
+    def __next__(self) -> float:
+        if self.patience is not None and self.stale >= self.patience:
+            raise StopIteration
+
+        if self.seconds is None:
+            if self.epoch >= len(self.temps):
+                raise StopIteration
+            index = self.epoch
+        else:
+            if self.start is None:
+                self.start = self.clock()
+            elapsed = (self.clock() - self.start) / self.seconds
+            if elapsed >= 1:
+                raise StopIteration
+            index = int(elapsed * len(self.temps))
+
+        self.epoch += 1
+        return self.temps[index].item()
@@ -0,0 +1,147 @@
+"""
+Parallel tempering (replica exchange): replicas of a solution are annealed
+at fixed temperatures of a ladder, each in its own process, and every
+`exchange_every` epochs neighbouring temperatures are swapped between
+replicas using Metropolis acceptance. Hot replicas explore, cold ones
+polish, and swaps pass good states down the ladder.
+"""
+
+from __future__ import annotations
+
+import random
+import typing as tp
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from lib.anneal import Metric, J, LogUniforms, evaluate_probability, iterate_inplace
+from lib.snapshot import Snapshot
+from lib.temperature import Adaptive
+from lib.workers import workers
+
+
+@dataclass
+class TemperingResult:
+    """
+    - `best` is the snapshot of the best solution seen by any replica
+    - `history` has replicas' metrics, ordered by temperature, after each round
+    - `best_history` has the best metric so far after each round
+    """
+
+    temps: list[float]
+    best: Snapshot | None
+    best_f: float
+    history: list[list[float]] = field(default_factory=list)
+    best_history: list[float] = field(default_factory=list)
+    swaps_accepted: int = 0
+    swaps_proposed: int = 0
+
+
+def swap_probability(temp_a: float, f_a: float, temp_b: float, f_b: float) -> float:
+    """
+    Probability to swap temperatures of replicas a and b, i.e. Metropolis
+    acceptance of the joint state, which energy is `f / temp` summed over
+    replicas.
+    """
+    return evaluate_probability(f_a / temp_a + f_b / temp_b, f_b / temp_a + f_a / temp_b, 1)
+
+
+def _replica(conn, init: J, f: Metric[J], A: tp.Callable[[J, int], tp.Any], seed: int) -> None:
+    """
+    Worker loop: receives (temp, epochs), anneals `init` in place for that
+    many epochs, sends back (f_curr, best_f). `None` stops the worker, which
+    sends back (best_f, best snapshot) before exit.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+    def step(x: J, epoch: int) -> None:
+        A(x, epoch)
+        moved[:] = x.journal
+
+    curr, f_curr = init, f(init)
+    log_us = LogUniforms()
+    done, best_f, best = 0, f_curr, Snapshot.take([curr], epoch=0, temperature=0)
+    while (message := conn.recv()) is not None:
+        temp, epochs = message
+        # snapshots are O(candidates), and records are frequent early on, so
+        # the round's best is snapshotted once, at its end, rolled back by
+        # undo-journal entries of the moves accepted after it
+        moved, since_best, best_epoch, best_score = [], [], None, None
+        for epoch in range(done, done + epochs):
+            f_curr, accepted = iterate_inplace(curr, f_curr, temp, f, lambda x: step(x, epoch), log_us.draw())
+            if not accepted:
+                continue
+            if f_curr < best_f:
+                best_f, best_epoch, best_score = f_curr, epoch + 1, curr.get_score()
+                since_best.clear()
+            else:
+                since_best.extend(moved)
+        if best_epoch is not None:
+            best = Snapshot.take([curr], epoch=best_epoch, temperature=temp)
+            best.rollback(since_best, best_score)
+        done += epochs
+        conn.send((f_curr, best_f))
+    conn.send((best_f, best))
+    conn.close()
+
+
+def anneal_tempering(
+    init: J,
+    temps: tp.Sequence[float],
+    f: Metric[J],
+    A: tp.Callable[[J, int], tp.Any],
+    rounds: int,
+    *,
+    exchange_every: int = 100,
+    seed: int | None = None,
+    callback: tp.Callable[[int, TemperingResult], None] | None = None,
+) -> TemperingResult:
+    """
+    :param init: initial solution, every replica starts with its copy: J
+    :param temps: temperature ladder, one replica per temperature, e.g.
+        `lib.temperature.exponential(...)(replicas)`
+    :param f: metric to minimize: J -> float
+    :param A: in place operator: (J, epoch) -> Any, see `anneal_inplace`
+    :param rounds: number of exchange rounds, each is `exchange_every` epochs
+    :param seed: seeds replicas and swaps, fresh entropy if None
+    :param callback: called with (round, result so far) after each round,
+        note that `result.best` is set only at the end
+    :return: best solution snapshot and metrics history
+
+    See `lib.workers` on pickling of `init`, `f` and `A`.
+    """
+
+    assert not isinstance(temps, Adaptive), "adaptive schedule is not a ladder"
+    temps = sorted(temps)
+    assert len(temps) > 0 and temps[0] > 0
+    seeds = np.random.SeedSequence(seed).generate_state(len(temps) + 1).tolist()
+    rng = random.Random(seeds.pop())
+
+    result = TemperingResult(temps=temps, best=None, best_f=f(init))
+    # replicas[i] is the replica at temps[i]
+    replicas = list(range(len(temps)))
+    with workers(_replica, [(init, f, A, replica_seed) for replica_seed in seeds]) as conns:
+        for exchange in range(rounds):
+            for temp, replica in zip(temps, replicas):
+                conns[replica].send((temp, exchange_every))
+            fs, best_fs = zip(*(conn.recv() for conn in conns))
+            result.best_f = min(result.best_f, *best_fs)
+            result.history.append([fs[replica] for replica in replicas])
+            result.best_history.append(result.best_f)
+
+            # even and odd neighbouring pairs in turns
+            for i in range(exchange % 2, len(temps) - 1, 2):
+                a, b = replicas[i], replicas[i + 1]
+                result.swaps_proposed += 1
+                if rng.random() < swap_probability(temps[i], fs[a], temps[i + 1], fs[b]):
+                    replicas[i], replicas[i + 1] = b, a
+                    result.swaps_accepted += 1
+
+            if callback is not None:
+                callback(exchange, result)
+
+        for conn in conns:
+            conn.send(None)
+        result.best_f, result.best = min((conn.recv() for conn in conns), key=lambda best: best[0])
+    return result
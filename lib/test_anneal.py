@@ -0,0 +1,94 @@
+import math
+import random
+
+from lib.anneal import LogUniforms, accept, anneal_inplace
+from lib.history import History, DownsampledHistory, SummaryHistory
+
+
+class Counter:
+    """ toy journaled state: minimize |value - 10| by +-1 steps """
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.saved = None
+
+    def begin(self) -> None:
+        self.saved = self.value
+
+    def commit(self) -> None:
+        self.saved = None
+
+    def rollback(self) -> None:
+        self.value, self.saved = self.saved, None
+
+
+def metric(counter: Counter) -> float:
+    return abs(counter.value - 10)
+
+
+def step(counter: Counter, epoch: int) -> None:
+    counter.value += random.choice([-1, 1])
+
+
+def test_anneal_inplace():
+    random.seed(0)
+    init = Counter()
+    history = list(anneal_inplace(init, iter([1e-3] * 200), metric, step))
+
+    assert len(history) == 201
+    assert [record.epoch for record in history] == list(range(201))
+    scores = [record.f for record in history]
+    assert scores[-1] == 0 == metric(init)
+    # almost zero temperature never accepts worse states
+    assert all(next <= curr for curr, next in zip(scores, scores[1:]))
+    assert all(record.accepted for record, curr, next in zip(history[1:], scores, scores[1:]) if next < curr)
+
+
+def test_sweep():
+    def run(epochs, sweep):
+        random.seed(0)
+        return list(anneal_inplace(Counter(), iter([1.0] * epochs), metric, step, sweep=sweep))
+
+    flat, swept = run(200, sweep=1), run(40, sweep=5)
+    assert len(swept) == 41
+    # same moves at the same temperature, recorded every 5th
+    assert [record.fs for record in swept] == [record.fs for record in flat[::5]]
+    assert sum(record.accepted for record in swept) == sum(record.accepted for record in flat)
+    assert max(record.accepted for record in swept) > 1
+
+
+def test_history():
+    def stream():
+        random.seed(0)
+        return anneal_inplace(Counter(), iter([1.0] * 100), metric, step)
+
+    full = History().consume(stream())
+    downsampled = DownsampledHistory(every=30).consume(stream())
+    summary = SummaryHistory().consume(stream())
+
+    assert len(full.records) == 101
+    assert [record.epoch for record in downsampled.records] == [0, 30, 60, 90]
+    assert downsampled.records == full.records[::30]
+    assert summary.records == []
+    for history in (full, downsampled, summary):
+        assert history.epochs == 100
+        assert history.accepted == sum(record.accepted for record in full.records)
+        assert history.best.f == min(record.f for record in full.records)
+        assert history.last == full.records[-1]
+
+
+def test_log_uniforms():
+    random.seed(0)
+    log_us = LogUniforms(batch=1000)
+    drawn = [log_us.draw() for _ in range(2500)]
+    assert all(log_u <= 0 for log_u in drawn)
+
+    # batches are seeded by `random`
+    random.seed(0)
+    log_us = LogUniforms(batch=1000)
+    assert [log_us.draw() for _ in range(1500)] == drawn[:1500]
+
+    # worse neighbour is accepted with exp(-delta / temp) probability
+    rate = sum(accept(1.0, 2.0, 0.5, log_u) for log_u in drawn) / len(drawn)
+    assert abs(rate - math.exp(-2)) < 0.03
+    assert all(accept(2.0, 1.0, 0.5, log_u) for log_u in drawn)
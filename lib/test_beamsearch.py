@@ -0,0 +1,39 @@
+import pytest
+
+from lib.beamsearch import anneal_beamsearch_parallel
+from lib.solution import Solution, ArraySolution
+from lib.temperature import exponential
+from lib.test_snapshot import random_trace, MUTATION
+
+
+def metric(solution) -> float:
+    return -solution.get_score()
+
+
+def mutate(solution, epoch: int):
+    solution = solution.diff()
+    MUTATION(solution, epoch)
+    return solution
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_anneal_beamsearch_parallel(solution_type):
+    trace = random_trace()
+
+    def run(processes):
+        init = solution_type.empty(trace)
+        last = []
+        history = list(anneal_beamsearch_parallel(
+            init, iter(exponential(10, 1.05)(60)), metric, mutate, size=4, processes=processes, seed=0,
+            callback=lambda epoch, temp, currs: last.__setitem__(slice(None), currs),
+        ))
+        for curr, f_curr in last:
+            curr.validate()
+            assert f_curr == metric(curr)
+        assert sorted(history[-1].fs) == sorted(f_curr for _curr, f_curr in last)
+        return [sorted(record.fs) for record in history]
+
+    scores = run(processes=2)
+    assert len(scores) == 61
+    assert min(scores[-1]) < 0
+    assert run(processes=3) == scores
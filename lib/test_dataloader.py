@@ -0,0 +1,127 @@
+import pickle
+
+import pytest
+import pandas as pd
+from ast import literal_eval
+
+from lib.dataloader import parse_lists, load_data, load_dir, load_synthetic, iter_synthetic, Dataset, task_wrap, CACHE_FILENAME
+
+
+def test_parse_lists():
+    column = pd.Series(["['a', 'b-c']", "[]", '["d"]', "['e']"])
+    expected = column.apply(lambda l: tuple(literal_eval(l)))
+    assert parse_lists(column).tolist() == expected.tolist() == [('a', 'b-c'), (), ('d',), ('e',)]
+
+    for malformed in ["['a', 1]", "['a' 'b']", "['a', 'b'", "[a]", None]:
+        with pytest.raises(ValueError):
+            parse_lists(pd.Series(["['a']", malformed]))
+
+
+def write_trace_dir(path, score):
+    path.mkdir(exist_ok=True)
+    pd.DataFrame({
+        'candidate_id': ['c1', 'c1'],
+        'route_id': ['r1', 'r2'],
+        'chosen_for_proposition_flg': [1, 0],
+        'score': [score, 1],
+    }).to_csv(path / 'trace.csv')
+    pd.DataFrame({
+        'route_id': ['r1', 'r2', 'r2'],
+        'claim_segment_uuid_list': ["['A', 'B']", "['B']", "['B']"],
+    }).to_csv(path / 'routes.csv')
+
+
+def test_load_data(tmp_path):
+    write_trace_dir(tmp_path / 'x', score=10)
+    write_trace_dir(tmp_path / 'y', score=20)
+
+    for processes in [1, 2]:
+        data = load_data(tmp_path, processes=processes)
+        assert sorted(data) == ['x', 'y']
+        assert data['y']['trace'].score.tolist() == [20, 1]
+        assert data['y']['trace'].chosen_for_proposition_flg.tolist() == [True, False]
+        assert data['y']['routes'].claim_segment_uuid_list.tolist() == [('A', 'B'), ('B',)]
+        assert (tmp_path / 'x' / CACHE_FILENAME).exists()
+
+    # cache is invalidated by csv change
+    write_trace_dir(tmp_path / 'x', score=300)
+    data = load_data(tmp_path, processes=1)
+    assert data['x']['trace'].score.tolist() == [300, 1]
+
+
+def test_load_dir_cache(tmp_path):
+    write_trace_dir(tmp_path / 'x', score=10)
+    write_trace_dir(tmp_path / 'y', score=20)
+    # only the frames are cached, wraps are run on every load
+    assert load_dir(tmp_path / 'x', wrap=lambda trace, routes: 'a') == 'a'
+    assert (tmp_path / 'x' / CACHE_FILENAME).exists()
+    assert load_dir(tmp_path / 'x', wrap=lambda trace, routes: 'b') == 'b'
+    assert load_dir(tmp_path / 'x')['trace'].score.tolist() == [10, 1]
+
+    # not picklable wraps are loaded serially
+    data = load_data(tmp_path, wrap=lambda trace, routes: trace.score.tolist(), processes=2)
+    assert data == {'x': [10, 1], 'y': [20, 1]}
+
+
+def test_iter_synthetic(tmp_path):
+    path = tmp_path / 'synthetic.csv'
+    pd.DataFrame({
+        'trace_id': [7, 7, 7, 3, 5, 5],
+        'candidate_id': ['c1', 'c2', 'c2', 'c1', 'c1', 'c2'],
+        'route_id': ['r1', 'r2', 'r3', 'r4', 'r5', 'r6'],
+        'assigned_flg': [1, 0, 1, 0, 0, 1],
+        'score': [1, 2, 3, 4, 5, 6],
+        'claim_segment_uuid_list': ["['A']", "['B']", "['A', 'B']", "['A']", "['C']", "['D']"],
+    }).to_csv(path, index=False)
+
+    expected = load_synthetic(path)
+    assert list(expected) == [7, 3, 5]
+
+    for chunksize in [1, 2, 4, 100]:
+        streamed = list(iter_synthetic(path, chunksize=chunksize))
+        assert [trace_id for trace_id, _data in streamed] == [7, 3, 5]
+        for trace_id, data in streamed:
+            for key in ['trace', 'routes']:
+                pd.testing.assert_frame_equal(data[key], expected[trace_id][key])
+
+    csv = pd.read_csv(path)
+    csv.iloc[[0, 4]] = csv.iloc[[4, 0]].to_numpy()
+    csv.to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        list(iter_synthetic(path, chunksize=2))
+
+
+def test_Dataset(tmp_path):
+    write_trace_dir(tmp_path / 'x', score=10)
+    write_trace_dir(tmp_path / 'y', score=20)
+    write_trace_dir(tmp_path / 'z', score=30)
+    pd.DataFrame({
+        'candidate_id': ['c1'], 'route_id': ['r1'], 'chosen_for_proposition_flg': [1], 'score': [1],
+    }).to_csv(tmp_path / 'z' / 'trace.csv')
+
+    dataset = Dataset(tmp_path, max_resident=2)
+    assert len(dataset) == 3 and list(dataset) == ['x', 'y', 'z']
+    assert len(dataset.resident) == 0
+
+    assert dataset.size('x') == 2 and dataset.size('z') == 1
+    assert dataset.sorted_by_size() == ['z', 'x', 'y']
+    assert dataset.sorted_by_size(min_size=2) == ['x', 'y']
+    assert len(dataset.resident) == 0, "sizes are known without loading"
+
+    assert dataset['x']['trace'].score.tolist() == [10, 1]
+    assert dataset['y']['trace'].score.tolist() == [20, 1]
+    assert dataset['x'] is dataset['x']
+    assert dataset['z']['trace'].score.tolist() == [1]
+    assert list(dataset.resident) == ['x', 'z']
+
+    tasks = Dataset(tmp_path, wrap=task_wrap, max_resident=1)
+    assert tasks['y'].trace.yandex_score == 20
+    assert tasks['y'].task_solutions == []
+
+    # tasks are not cached on disk, only the frames
+    with open(tmp_path / 'y' / CACHE_FILENAME, 'rb') as handle:
+        _key, frames = pickle.load(handle)
+    assert all(isinstance(frame, pd.DataFrame) for frame in frames.values())
+    task = tasks['y']
+    tasks['x']
+    assert tasks['y'] is not task and tasks['y'].trace.yandex_score == 20
@@ -1,4 +1,7 @@
-from lib.funny import SequenceInterface, StackedSequences, shuffled_range, shuffled_sequence
+import random
+from collections import Counter
+
+from lib.funny import AliasTable, SequenceInterface, StackedSequences, shuffled_range, shuffled_sequence
 
 def test_SequenceInterface_simple():
     seq = [1, 2, 3]
@@ -83,3 +86,20 @@ def test_shuffled_sequence():
     
     assert list(shuffled_sequence(sorted_seq)) != sorted_seq
     assert list(shuffled_sequence(sorted_seq)) != list(shuffled_sequence(sorted_seq))
+
+
+#
+
+
+def test_AliasTable():
+    random.seed(0)
+    weights = [1, 0, 3, 6]
+    table = AliasTable(weights)
+
+    n = 100_000
+    counts = Counter(table.sample() for i in range(n))
+    assert counts[1] == 0
+    for index, weight in enumerate(weights):
+        assert abs(counts[index] / n - weight / sum(weights)) < 0.01
+
+    assert {AliasTable([5]).sample() for i in range(10)} == {0}
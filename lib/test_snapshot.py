@@ -0,0 +1,178 @@
+import math
+import random
+
+import pytest
+
+from lib import mut
+from lib.anneal import anneal, anneal_beamsearch, anneal_inplace
+from lib.snapshot import Snapshot, BestSnapshot
+from lib.solution import Solution, ArraySolution
+from lib.solver.anneal_solver import AnnealSolver
+from lib.task import Task
+from lib.temperature import exponential
+from lib.trace import Trace
+
+
+def random_trace(n: int=40, seed: int=0) -> Trace:
+    rng = random.Random(seed)
+    return Trace(
+        candidates={c: {f"r{c}-{i}": rng.randint(1, 100) for i in range(3)} for c in range(n)},
+        customers_by_route={
+            f"r{c}-{i}": set(rng.sample(range(2 * n), 2)) for c in range(n) for i in range(3)
+        },
+    )
+
+
+MUTATION = mut.randomize(
+    mut.Flip(),
+    mut.TryMakeBusyRandomCandidateWithRandomRoute,
+    mut.TryMakeBusyRandomCandidateWithGreedyRoute,
+    mut.TryMakeIdleRandomCandidate,
+    k=2,
+)
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_save_restore(tmp_path, solution_type):
+    trace = random_trace()
+    random.seed(1)
+    solution = solution_type.empty(trace)
+    for epoch in range(100):
+        MUTATION(solution, epoch)
+
+    Snapshot.take([solution], epoch=100, temperature=0.5).save(tmp_path / 'snapshot')
+    snapshot = Snapshot.load(tmp_path / 'snapshot')
+    assert (snapshot.epoch, snapshot.temperature) == (100, 0.5)
+    assert snapshot.rng_state == random.getstate()
+
+    restored, = snapshot.restore(trace, solution_type)
+    restored.validate()
+    assert restored.get_score() == solution.get_score() == snapshot.scores[0]
+    # same pools, hence same random picks
+    assert list(restored.iter_candidates()) == list(solution.iter_candidates())
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_rollback(solution_type):
+    trace = random_trace()
+    random.seed(1)
+    solution = solution_type.empty(trace)
+    for epoch in range(50):
+        MUTATION(solution, epoch)
+    expected = dict(solution.iter_candidates(busy=True))
+    score = solution.get_score()
+
+    solution.begin()
+    for epoch in range(50, 100):
+        MUTATION(solution, epoch)
+    snapshot = Snapshot.take([solution], epoch=100, temperature=0.5)
+    snapshot.rollback(solution.journal, score)
+    solution.commit()
+
+    restored, = snapshot.restore(trace, solution_type)
+    restored.validate()
+    assert dict(restored.iter_candidates(busy=True)) == expected
+    assert restored.get_score() == score == snapshot.scores[0]
+
+
+@pytest.mark.parametrize("engine", ["anneal", "inplace", "beamsearch"])
+def test_best_snapshot(engine):
+    trace = random_trace()
+    best, eager = BestSnapshot(), {}
+
+    def metric(solution) -> float:
+        return -solution.get_score()
+
+    def mutate(solution, epoch):
+        solution = solution.diff()
+        MUTATION(solution, epoch)
+        return solution
+
+    def callback(epoch, temp, currs):
+        curr, f_curr = min(currs, key=lambda item: item[1])
+        if f_curr < eager.get('f', math.inf):
+            eager.update(f=f_curr, assignment=dict(curr.iter_candidates(busy=True)))
+        best(epoch, temp, currs)
+
+    random.seed(0)
+    init, temps = Solution.empty(trace), iter(exponential(10, 1.01)(500))
+    if engine == "inplace":
+        stream = anneal_inplace(init, temps, metric, MUTATION, callback=callback)
+    elif engine == "anneal":
+        stream = anneal(init, temps, metric, mutate, callback=callback)
+    else:
+        stream = anneal_beamsearch(init, temps, metric, mutate, size=3, callback=callback)
+    for _record in stream:
+        pass
+    assert best.root.trail is not None
+    best.stop()
+    assert best.root is None
+
+    restored, = best.best.restore(trace)
+    restored.validate()
+    assert -restored.get_score() == best.best_f == eager['f']
+    assert dict(restored.iter_candidates(busy=True)) == eager['assignment']
+
+
+class Interrupt(Exception):
+    pass
+
+
+@pytest.mark.parametrize("beamsearch_size", [None, 2])
+def test_resume(tmp_path, beamsearch_size):
+    trace = random_trace()
+    path = tmp_path / 'snapshot'
+
+    def interrupted(solution, epoch):
+        if epoch == 250:
+            raise Interrupt
+        return MUTATION(solution, epoch)
+
+    def solve(mutation, checkpoint):
+        task = Task(trace)
+        solver = AnnealSolver(
+            mutation, epoches=300, temp=exponential(10, 1.01), beamsearch_size=beamsearch_size,
+            checkpoint=checkpoint, checkpoint_every=100,
+        )
+        solver.solve(task)
+        return task.task_solutions[0].score_history_all
+
+    random.seed(2)
+    expected = solve(MUTATION, checkpoint=None)
+
+    random.seed(2)
+    with pytest.raises(Interrupt):
+        solve(interrupted, checkpoint=lambda task: path)
+    assert Snapshot.load(path).epoch == 200
+
+    random.seed(3) # resumed run must not depend on the current state
+    resumed = solve(MUTATION, checkpoint=lambda task: path)
+    assert not path.exists()
+
+    assert len(resumed) == 101
+    if beamsearch_size is None:
+        assert resumed == expected[200:]
+    else:
+        # beam is restored as diffs, so only the assignments are repeated
+        assert sorted(resumed[0]) == sorted(expected[200])
+
+
+def test_checkpoint_retries(tmp_path):
+    task = Task(random_trace())
+    paths = []
+
+    def checkpoint(task):
+        paths.append(tmp_path / '{}-{}'.format(*task.job))
+        return paths[-1]
+
+    solver = AnnealSolver(MUTATION, epoches=300, temp=exponential(10, 1.01), checkpoint=checkpoint, checkpoint_every=100)
+    solver.solve_all(task, retries=3, seed=0)
+    assert len(set(paths)) == 3 and not any(path.exists() for path in paths)
+    histories = [task_solution.score_history for task_solution in task.task_solutions]
+    assert [len(history) for history in histories] == [301] * 3
+    assert histories[0] != histories[1]
+
+    # snapshot of a finished run is not resumed
+    Snapshot.take([Solution.empty(task.trace)], epoch=300, temperature=1).save(paths[0])
+    solver.solve_all(task, seed=0)
+    assert len(task.task_solutions[-1].score_history) == 301
@@ -1,11 +1,13 @@
 import pytest
+import random
 import typing as tp
+from collections import Counter
 from copy import deepcopy
 
 from lib.trace import Trace
-from lib.solution import Solution, SolutionDiff
+from lib.solution import Solution, SolutionDiff, ArraySolution, apply_move
 
-def generate_trace():
+def generate_trace(**kwargs):
     return Trace(
         candidates={
             "Sam Porter Bridges": {
@@ -24,35 +26,43 @@ def generate_trace():
             "r3": {"B"},
             "r4": {"B", "C"},
             "r5": {"C"},
-        }
+        },
+        **kwargs,
     )
 
 
+# ids are interned in order of appearance, hence are the same for every generated trace
+_trace = generate_trace()
+SAM, VETERAN = (_trace.candidate_keys[key] for key in ["Sam Porter Bridges", "The Veteran Porter"])
+R1, R2, R3, R4, R5 = (_trace.route_keys[key] for key in ["r1", "r2", "r3", "r4", "r5"])
+CA, CB, CC = (_trace.customer_keys[key] for key in ["A", "B", "C"])
+
+
 def test_get_candidates_on_customers():
     trace = generate_trace()
     a = Solution.empty(trace)
-    a.make_busy("Sam Porter Bridges", "r1")
-    assert a.get_candidates_on_customers({"A"}) == {"Sam Porter Bridges"}
-    a.make_idle("Sam Porter Bridges")
-    a.make_busy("Sam Porter Bridges", "r2")
-    assert a.get_candidates_on_customers({"A"}) == {"Sam Porter Bridges"}
-    assert a.get_candidates_on_customers({"A", "B"}) == {"Sam Porter Bridges"}
-    assert a.get_candidates_on_customers({"B"}) == {"Sam Porter Bridges"}
-    a.make_busy("The Veteran Porter", "r5")
-    assert a.get_candidates_on_customers({"C"}) == {"The Veteran Porter"}
-    assert a.get_candidates_on_customers({"A", "C"}) == {"Sam Porter Bridges", "The Veteran Porter"}
-    assert a.get_candidates_on_customers({"B"}) == {"Sam Porter Bridges"}
+    a.make_busy(SAM, R1)
+    assert a.get_candidates_on_customers({CA}) == {SAM}
+    a.make_idle(SAM)
+    a.make_busy(SAM, R2)
+    assert a.get_candidates_on_customers({CA}) == {SAM}
+    assert a.get_candidates_on_customers({CA, CB}) == {SAM}
+    assert a.get_candidates_on_customers({CB}) == {SAM}
+    a.make_busy(VETERAN, R5)
+    assert a.get_candidates_on_customers({CC}) == {VETERAN}
+    assert a.get_candidates_on_customers({CA, CC}) == {SAM, VETERAN}
+    assert a.get_candidates_on_customers({CB}) == {SAM}
 
     a = a.diff()
 
-    assert a.get_candidates_on_customers({"A", "B", "C"}) == {"Sam Porter Bridges", "The Veteran Porter"}
-    a.make_idle("Sam Porter Bridges")
-    assert a.get_candidates_on_customers({"C"}) == {"The Veteran Porter"}
-    a.make_busy("Sam Porter Bridges", "r1")
-    assert a.get_candidates_on_customers({"A", "C"}) == {"Sam Porter Bridges", "The Veteran Porter"}
+    assert a.get_candidates_on_customers({CA, CB, CC}) == {SAM, VETERAN}
+    a.make_idle(SAM)
+    assert a.get_candidates_on_customers({CC}) == {VETERAN}
+    a.make_busy(SAM, R1)
+    assert a.get_candidates_on_customers({CA, CC}) == {SAM, VETERAN}
 
 
-def compare(a: Solution, b: Solution, customers: set[str]):
+def compare(a: Solution, b: Solution, customers: set[int]):
     assert a.get_score() == b.get_score()
     assert a.get_busy_candidates_count() == b.get_busy_candidates_count()
     assert a.get_idle_candidates_count() == b.get_idle_candidates_count()
@@ -65,25 +75,27 @@ def compare(a: Solution, b: Solution, customers: set[str]):
 
 
 def valid_straight(solution: Solution) -> Solution:
-    solution.make_busy("Sam Porter Bridges", "r1")
-    solution.make_busy("The Veteran Porter", "r4")
+    solution.make_busy(SAM, R1)
+    solution.make_busy(VETERAN, R4)
     return solution
 
 
 def valid_unsure(solution: Solution) -> Solution:
-    solution.make_busy("Sam Porter Bridges", "r2")
-    solution.make_idle("Sam Porter Bridges")
-    solution.make_busy("Sam Porter Bridges", "r1")
-    solution.make_busy("The Veteran Porter", "r4")
+    solution.make_busy(SAM, R2)
+    solution.make_idle(SAM)
+    solution.make_busy(SAM, R1)
+    solution.make_busy(VETERAN, R4)
     return solution
 
 
 @pytest.mark.parametrize("trace,func,customers", [
-    (generate_trace(), lambda solution: solution, {"A", "B", "C"}),
-    (generate_trace(), valid_straight, {"A", "B", "C"}),
-    (generate_trace(), valid_unsure, {"A", "B", "C"}),
+    (generate_trace(), lambda solution: solution, {CA, CB, CC}),
+    (generate_trace(), valid_straight, {CA, CB, CC}),
+    (generate_trace(), valid_unsure, {CA, CB, CC}),
+    (generate_trace(bitsets=True), valid_straight, {CA, CB, CC}),
+    (generate_trace(bitsets=True), valid_unsure, {CA, CB, CC}),
 ])
-def test_compare_solutions(trace: Trace, func, customers: set[str]):
+def test_compare_solutions(trace: Trace, func, customers: set[int]):
     a = func(Solution.empty(trace))
     b = func(Solution.empty(trace).diff())
     c = func(Solution.empty(trace).diff().diff())
@@ -91,13 +103,41 @@ def test_compare_solutions(trace: Trace, func, customers: set[str]):
     compare(a, b, customers)
     compare(a, c, customers)
 
+    d = func(ArraySolution.empty(trace))
+    e = func(ArraySolution.empty(trace).diff().diff())
+    compare(a, d, customers)
+    compare(a, e, customers)
+    d.validate()
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+@pytest.mark.parametrize("bitsets", [False, True])
+def test_has_route_overlap(bitsets: bool, solution_type):
+    a = solution_type.empty(generate_trace(bitsets=bitsets))
+    a.make_busy(SAM, R2)
+    assert [a.has_route_overlap(route) for route in [R1, R2, R3, R4, R5]] == [True, True, True, True, False]
+
+    b = a.diff()
+    b.make_idle(SAM)
+    b.make_busy(SAM, R1)
+    assert [b.has_route_overlap(route) for route in [R1, R2, R3, R4, R5]] == [True, True, False, False, False]
 
-def test_history():
+    c = b.diff()
+    c.make_busy(VETERAN, R4)
+    assert [c.has_route_overlap(route) for route in [R1, R2, R3, R4, R5]] == [True, True, True, True, True]
+    assert c.apply() is b
+    assert [b.has_route_overlap(route) for route in [R1, R2, R3, R4, R5]] == [True, True, True, True, True]
+    assert b.apply() is a
+    assert [a.has_route_overlap(route) for route in [R1, R2, R3, R4, R5]] == [True, True, True, True, True]
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_history(solution_type):
     trace: Trace = generate_trace()
-    customers: set[str] = {"A", "B", "C"}
+    customers: set[int] = {CA, CB, CC}
 
-    A = [Solution.empty(trace)]
-    B = [Solution.empty(trace)]
+    A = [solution_type.empty(trace)]
+    B = [solution_type.empty(trace)]
 
     def append():
         A.append(deepcopy(A[-1]))
@@ -122,19 +162,19 @@ def test_history():
             raise
 
     def mutate_1(solution):
-        solution.make_busy("Sam Porter Bridges", "r1")
-        solution.make_busy("The Veteran Porter", "r4")
+        solution.make_busy(SAM, R1)
+        solution.make_busy(VETERAN, R4)
         return solution
 
     def mutate_2(solution):
-        solution.make_idle("The Veteran Porter")
-        solution.make_busy("The Veteran Porter", "r5")
-        solution.make_idle("Sam Porter Bridges")
-        solution.make_busy("Sam Porter Bridges", "r2")
+        solution.make_idle(VETERAN)
+        solution.make_busy(VETERAN, R5)
+        solution.make_idle(SAM)
+        solution.make_busy(SAM, R2)
         return solution
 
     def mutate_3(solution):
-        solution.make_idle("Sam Porter Bridges")
+        solution.make_idle(SAM)
         return solution
 
     for i, mutate in enumerate([mutate_1, mutate_2, mutate_3, ], 1):
@@ -142,3 +182,217 @@ def test_history():
         append()
         mutate_last(mutate)
         compare_all()
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_deep_chain_optimize(solution_type):
+    from lib.optimize import optimize
+
+    trace = generate_trace()
+    customers = {CA, CB, CC}
+
+    steps = [
+        lambda s: s.make_busy(SAM, R1),
+        lambda s: s.make_busy(VETERAN, R4),
+        lambda s: s.make_idle(VETERAN),
+        lambda s: s.make_busy(VETERAN, R3),
+        lambda s: (s.make_idle(VETERAN), s.make_busy(VETERAN, R5)),
+        lambda s: (s.make_idle(SAM), s.make_busy(SAM, R2)),
+    ]
+
+    reference = [solution_type.empty(trace)]
+    chain = [solution_type.empty(trace)]
+    for step in steps:
+        reference.append(deepcopy(reference[-1]))
+        step(reference[-1])
+        chain.append(chain[-1].diff())
+        step(chain[-1])
+        # lookups build overlays all over the chain
+        for a, b in zip(reference, chain):
+            compare(a, b, customers)
+
+    # branch in the middle, so only part of the chain collapses
+    branch = chain[3].diff()
+    branch.make_idle(SAM)
+
+    optimized = [solution for solution, _score in optimize([(chain[-1], 0), (branch, 0)])]
+    # the chain before the branching point is collapsed into the root, and
+    # the one after it into its first node
+    leaf = chain[4]
+    assert len(optimized) == 2 and {id(leaf), id(branch)} == set(map(id, optimized))
+    assert branch.parent is chain[0] is leaf.parent
+    compare(reference[-1], leaf, customers)
+
+    expected_branch = deepcopy(reference[3])
+    expected_branch.make_idle(SAM)
+    compare(expected_branch, branch, customers)
+
+    # relinked diffs are still released as usual
+    assert chain[0]._children.keys() == {id(leaf), id(branch)}
+    branch.release()
+    compare(reference[-1], leaf, customers)
+    leaf.release()
+    assert not chain[0]._children
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_journal(solution_type):
+    trace = generate_trace()
+    customers = {CA, CB, CC}
+
+    a = valid_straight(solution_type.empty(trace))
+    expected = deepcopy(a)
+
+    a.begin()
+    a.make_idle(SAM)
+    a.make_idle(VETERAN)
+    a.make_busy(VETERAN, R3)
+    a.make_busy(SAM, R1)
+    diff = a.diff()
+    diff.make_idle(SAM)
+    diff.apply()
+    a.rollback()
+    compare(a, expected, customers)
+
+    a.begin()
+    a.make_idle(SAM)
+    assert a.get_journal_move() == ((SAM,), ())
+    a.commit()
+    expected.make_idle(SAM)
+    compare(a, expected, customers)
+    assert a.journal is None
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_moves(solution_type):
+    trace = generate_trace()
+    root = solution_type.empty(trace)
+    root.make_busy(SAM, R1)
+    root.make_busy(VETERAN, R3)
+
+    a = root.diff()
+    a.make_idle(SAM)
+    b = a.diff()
+    b.make_idle(VETERAN)
+    b.make_busy(VETERAN, R5)
+    assert b.get_move() == ((), ((VETERAN, R5),))
+    assert b.get_root_move() == ((SAM,), ((VETERAN, R5),))
+
+    # net changes only
+    move = b.get_root_move()
+    root.begin()
+    apply_move(root, move)
+    root.make_busy(SAM, R2)
+    root.make_idle(SAM)
+    assert root.get_journal_move() == move
+    root.commit()
+    assert [root.get_route(candidate) for candidate in [SAM, VETERAN]] == [None, R5]
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_diff_sampling(solution_type):
+    # every candidate has own route, so any state is valid
+    n = 30
+    trace = Trace(
+        candidates={c: {f"r{c}": 1 + c} for c in range(n)},
+        customers_by_route={f"r{c}": {c} for c in range(n)},
+    )
+    rng = random.Random(7)
+    solution = root = solution_type.empty(trace)
+    chain = []
+    for depth in range(5):
+        for _ in range(10):
+            candidate = rng.randrange(n)
+            if solution.get_route(candidate) is None:
+                solution.make_busy(candidate, candidate)
+            else:
+                solution.make_idle(candidate)
+        chain.append(solution)
+        solution = solution.diff()
+
+    def check(solution):
+        busy = {c for c in range(n) if solution.get_route(c) is not None}
+        assert {c for c, _ in solution.iter_candidates(busy=True, shuffle=True)} == busy
+        assert {c for c, _ in solution.iter_candidates(busy=False, shuffle=True)} == set(range(n)) - busy
+        assert sorted(c for c, _ in solution.iter_candidates()) == list(range(n))
+        counts = Counter(solution.get_random_busy_candidate() for _ in range(200 * len(busy)))
+        assert counts.keys() == {(c, c) for c in busy}
+        assert min(counts.values()) > 100
+        counts = Counter(solution.get_random_idle_candidate()[0] for _ in range(200 * (n - len(busy))))
+        assert counts.keys() == set(range(n)) - busy
+        assert min(counts.values()) > 100
+
+    leaf = chain[-1]
+    check(leaf)
+    leaf.make_idle(next(c for c, _ in leaf.iter_candidates(busy=True)))
+    check(leaf)
+
+    # root changes, pools relative to it must be rebuilt
+    assert chain[1].apply() is root
+    chain[2].parent = root
+    check(leaf)
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_from_assignment(solution_type):
+    trace = generate_trace(baseline={"Sam Porter Bridges": "r1", "The Veteran Porter": "r4"}, yandex_score=600)
+    solution = solution_type.from_assignment(trace, trace.baseline)
+    solution.validate()
+    assert solution.get_score() == trace.yandex_score
+    assert solution.get_route(SAM) == R1
+    assert solution.get_route(VETERAN) == R4
+
+    with pytest.raises(AssertionError):
+        solution_type.from_assignment(trace, {SAM: R2, VETERAN: R4})
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_collapse(solution_type):
+    n = 30
+    trace = Trace(
+        candidates={c: {f"r{c}": 1 + c} for c in range(n)},
+        customers_by_route={f"r{c}": {c} for c in range(n)},
+    )
+    rng = random.Random(3)
+    root = solution_type.empty(trace)
+    nodes = [root]
+    for _ in range(40):
+        node = rng.choice(nodes).diff()
+        for _ in range(3):
+            candidate = rng.randrange(n)
+            if node.get_route(candidate) is None:
+                node.make_busy(candidate, candidate)
+            else:
+                node.make_idle(candidate)
+        nodes.append(node)
+
+    def state(solution):
+        return [solution.get_route(c) for c in range(n)]
+
+    leaves = [node for node in nodes if not node._children]
+    expected = [state(leaf) for leaf in leaves]
+    for node in rng.sample(nodes, len(nodes)):
+        if node._children:
+            node.release()
+
+    def check():
+        for leaf, leaf_state in zip(leaves, expected):
+            assert state(leaf) == leaf_state
+            leaf.validate()
+        # no single child chains are left
+        for leaf in leaves:
+            node = leaf.parent
+            while isinstance(node, SolutionDiff):
+                assert node._refs > 0 or len(node._children) > 1
+                node = node.parent
+            assert node is root
+
+    check()
+    while len(leaves) > 1:
+        leaves.pop().release()
+        expected.pop()
+        check()
+    leaf, = leaves
+    assert leaf.parent is root and state(root) == expected[0]
+    assert leaf.get_move() == ((), ())
+    assert leaf.unwrap() is root and not root._children
@@ -0,0 +1,49 @@
+import math
+import random
+
+import pytest
+
+from lib.temperature import Adaptive, Anytime, adaptive, linear
+
+
+def test_anytime_epoches():
+    assert list(Anytime(linear(10), 5)) == pytest.approx([10, 7.5, 5, 2.5, 1e-9])
+
+
+def test_anytime_seconds():
+    now = 0.
+    temps = Anytime(linear(10), 11, seconds=2, clock=lambda: now)
+    result = []
+    for temp in temps:
+        result.append(temp)
+        now += 0.5
+    assert result == pytest.approx([10, 8, 5, 2])
+
+
+def test_anytime_patience():
+    temps = Anytime(linear(10), 100, patience=3)
+    fs = iter([5, 4, 4, 3, 3, 3, 3, 2])
+    epochs = 0
+    for _temp in temps:
+        temps.observe(next(fs))
+        epochs += 1
+    assert epochs == 7
+
+
+@pytest.mark.parametrize("scale", [1., 1000.])
+def test_adaptive(scale):
+    rng = random.Random(0)
+    temps = adaptive(accept_init=0.3, accept_final=0.3, warmup=50)(3000)
+    assert isinstance(temps, Adaptive)
+    accepted = []
+    for epoch, temp in enumerate(temps):
+        if epoch < 50:
+            assert temp == temps.floor
+        delta = rng.expovariate(1 / scale) * rng.choice([-1, 1])
+        outcome = delta <= 0 or rng.random() < math.exp(-delta / temp)
+        temps.observe_move(delta, outcome)
+        if epoch >= 1000 and delta > 0:
+            accepted.append(outcome)
+    assert epoch == 2999
+    # worsening moves are accepted at the target rate regardless of the scale
+    assert sum(accepted) / len(accepted) == pytest.approx(0.3, abs=0.05)
@@ -0,0 +1,42 @@
+import pytest
+
+from lib.solution import Solution, ArraySolution
+from lib.tempering import anneal_tempering, swap_probability
+from lib.temperature import exponential
+from lib.test_snapshot import random_trace, MUTATION
+
+
+def test_swap_probability():
+    # colder replica got better state already, nothing to gain
+    assert swap_probability(1, -10, 2, -5) < 1
+    # hotter replica found better state, always pass it down
+    assert swap_probability(1, -5, 2, -10) == 1
+    assert swap_probability(1, -5, 2, -5) == 1
+
+
+def metric(solution) -> float:
+    return -solution.get_score()
+
+
+@pytest.mark.parametrize("solution_type", [Solution, ArraySolution])
+def test_anneal_tempering(solution_type):
+    trace = random_trace()
+    temps = exponential(10, 3.0)(3)
+
+    def run():
+        return anneal_tempering(solution_type.empty(trace), temps, metric, MUTATION, rounds=6, exchange_every=50, seed=0)
+
+    result = run()
+    assert result.temps == sorted(temps)
+    assert len(result.history) == len(result.best_history) == 6
+    assert all(len(fs) == 3 for fs in result.history)
+    assert result.best_history == sorted(result.best_history, reverse=True)
+    assert result.best_f == result.best_history[-1] <= min(min(fs) for fs in result.history)
+    assert result.swaps_proposed == 6
+
+    best, = result.best.restore(trace, solution_type)
+    best.validate()
+    assert -best.get_score() == result.best_f
+
+    again = run()
+    assert (again.history, again.best_f, again.swaps_accepted) == (result.history, result.best_f, result.swaps_accepted)
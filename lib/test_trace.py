@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+from lib.load_trace import save_trace, load_trace
+from lib.trace import Interner, Trace, from_df
+from lib.test_solution import generate_trace
+
+
+def test_Interner():
+    interner = Interner(['b', 'a', 'b'])
+    assert len(interner) == 2
+    assert interner['b'] == 0 and interner['a'] == 1
+    assert interner.intern('c') == 2
+    assert interner.intern('a') == 1
+    assert interner.keys == ['b', 'a', 'c']
+
+
+def test_trace_interning():
+    trace = generate_trace()
+
+    assert trace.get_candidates() == {
+        "Sam Porter Bridges": {"r1": 100, "r2": 200},
+        "The Veteran Porter": {"r3": 1000, "r4": 500, "r5": 200},
+    }
+    assert trace.get_customers_by_route() == {
+        "r1": {"A"}, "r2": {"A", "B"}, "r3": {"B"}, "r4": {"B", "C"}, "r5": {"C"},
+    }
+
+    veteran = trace.candidate_keys["The Veteran Porter"]
+    assert [trace.route_keys.keys[route] for route, _score in trace.candidates_linear[veteran]] == ["r3", "r4", "r5"]
+    assert trace.sorted_scores[veteran] == (1000, 500, 200)
+
+
+def keyed_linear(trace: Trace):
+    return {
+        trace.candidate_keys.keys[candidate]: [(trace.route_keys.keys[route], score) for route, score in routes]
+        for candidate, routes in enumerate(trace.candidates_linear)
+    }
+
+
+def test_from_df():
+    trace_df = pd.DataFrame({
+        'candidate_id': ['c2', 'c1', 'c2', 'c1', 'c3', 'c2'],
+        'route_id': ['r1', 'r2', 'r3', 'r4', 'r5', 'r6'],
+        'score': [10, 20, 30, 20, 5, 30],
+        'chosen_for_proposition_flg': [False, True, False, False, True, False],
+    })
+    routes_df = pd.DataFrame({
+        'route_id': ['r1', 'r2', 'r3', 'r4', 'r5', 'r6'],
+        'claim_segment_uuid_list': [('A',), ('A', 'B'), ('B', 'B'), ('C',), (), ('A', 'C')],
+    })
+
+    expected = Trace(
+        candidates=dict(trace_df.groupby('candidate_id').apply(lambda df: dict(zip(df['route_id'], df['score'])))),
+        customers_by_route={row.route_id: set(row.claim_segment_uuid_list) for _, row in routes_df.iterrows()},
+        baseline={'c1': 'r2', 'c3': 'r5'},
+        yandex_score=trace_df[trace_df.chosen_for_proposition_flg].score.sum(),
+    )
+    actual = from_df(trace_df, routes_df)
+
+    assert actual.get_candidates() == expected.get_candidates()
+    assert actual.get_customers_by_route() == expected.get_customers_by_route()
+    assert keyed_linear(actual) == keyed_linear(expected)
+    assert actual.yandex_score == expected.yandex_score == 25
+    assert actual.get_assignment(actual.baseline) == expected.get_assignment(expected.baseline) == {'c1': 'r2', 'c3': 'r5'}
+
+
+def test_from_df_duplicates():
+    trace_df = pd.DataFrame({
+        'candidate_id': ['c1', 'c1', 'c1', 'c2', 'c1'],
+        'route_id': ['r1', 'r2', 'r3', 'r1', 'r1'],
+        'score': [1., 5., 3., 2., 3.],
+        'chosen_for_proposition_flg': [True, False, False, True, True],
+    })
+    routes_df = pd.DataFrame({
+        'route_id': ['r1', 'r2', 'r3', 'r1'],
+        'claim_segment_uuid_list': [('A',), ('B',), ('C',), ('D',)],
+    })
+
+    expected = Trace(
+        candidates=dict(trace_df.groupby('candidate_id').apply(lambda df: dict(zip(df['route_id'], df['score'])))),
+        customers_by_route={row.route_id: set(row.claim_segment_uuid_list) for _, row in routes_df.iterrows()},
+    )
+    actual = from_df(trace_df, routes_df)
+
+    assert actual.get_candidates() == expected.get_candidates()
+    assert actual.get_customers_by_route() == expected.get_customers_by_route()
+    # r1 keeps the position of its first row, so it goes before r3 of the same score
+    assert keyed_linear(actual) == keyed_linear(expected)
+    assert keyed_linear(actual)['c1'] == [('r2', 5.), ('r1', 3.), ('r3', 3.)]
+    assert actual.yandex_score == trace_df[trace_df.chosen_for_proposition_flg].score.sum() == 6
+
+
+def test_save_load_trace(tmp_path):
+    trace = generate_trace(baseline={"Sam Porter Bridges": "r1", "The Veteran Porter": "r4"})
+    save_trace(trace, tmp_path / 'trace')
+    loaded = load_trace(tmp_path / 'trace')
+
+    assert isinstance(loaded.arrays.candidate_routes, np.memmap)
+    assert 'candidates_linear' not in vars(loaded), "expected lazy materialization"
+    assert (loaded.candidates_count, loaded.customers_count) == (trace.candidates_count, trace.customers_count)
+    assert 'customer_keys' not in vars(loaded), "counts are taken from arrays"
+
+    assert loaded.get_candidates() == trace.get_candidates()
+    assert loaded.get_customers_by_route() == trace.get_customers_by_route()
+    assert keyed_linear(loaded) == keyed_linear(trace)
+    assert loaded.yandex_score == trace.yandex_score
+    assert loaded.baseline == trace.baseline
+
+    empty = Trace()
+    save_trace(empty, tmp_path / 'empty')
+    assert load_trace(tmp_path / 'empty').get_candidates() == {}
+
+
+def test_conflicts():
+    trace = generate_trace()
+    route = trace.route_keys
+    customer = trace.customer_keys
+
+    routes_by_customer = {
+        customer.keys[c]: {route.keys[r] for r in trace.routes_by_customer[c]}
+        for c in range(len(trace.routes_by_customer))
+    }
+    assert routes_by_customer == {"A": {"r1", "r2"}, "B": {"r2", "r3", "r4"}, "C": {"r4", "r5"}}
+
+    route_conflicts = {
+        route.keys[r]: sorted(route.keys[other] for other in trace.route_conflicts[r])
+        for r in range(len(trace.route_conflicts))
+    }
+    assert route_conflicts == {
+        "r1": ["r2"],
+        "r2": ["r1", "r3", "r4"],
+        "r3": ["r2", "r4"],
+        "r4": ["r2", "r3", "r5"],
+        "r5": ["r4"],
+    }
+
+    sam = trace.candidate_keys["Sam Porter Bridges"]
+    assert {customer.keys[c] for c in trace.candidate_customers[sam]} == {"A", "B"}
+
+
+def test_get_route_sampler():
+    trace = generate_trace()
+    veteran = trace.candidate_keys["The Veteran Porter"]
+
+    sampler = trace.get_route_sampler(veteran)
+    assert sampler is trace.get_route_sampler(veteran)
+    assert sorted(sampler.prob) != [1, 1, 1]
+
+    # almost argmax for small temperature, almost uniform for the huge one
+    assert {trace.get_route_sampler(veteran, 1).sample() for i in range(100)} == {0}
+    assert {trace.get_route_sampler(veteran, 1e9).sample() for i in range(100)} == {0, 1, 2}
@@ -1,38 +1,368 @@
 from __future__ import annotations
 
+import typing as tp
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import pairwise
+
+import numpy as np
 import pandas as pd
 
+from lib.funny import AliasTable
+
+
+TCandidateKey = int
+TRouteKey = int
+TCustomerKey = int
+
+TKey = tp.TypeVar('TKey')
+
+
+class Interner(tp.Generic[TKey]):
+    """
+    Maps arbitrary hashable keys (uuid strings in our case) to dense integer
+    ids `0..len-1` in order of first appearance, and back.
+    """
+
+    def __init__(self, keys: tp.Iterable[TKey]=()) -> None:
+        self.keys: list[TKey] = []
+        self.ids: dict[TKey, int] = {}
+        for key in keys:
+            self.intern(key)
+
+    def intern(self, key: TKey) -> int:
+        index = self.ids.get(key)
+        if index is None:
+            index = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return index
+
+    @staticmethod
+    def from_unique(keys: tp.Sequence[TKey]) -> Interner[TKey]:
+        interner = Interner()
+        interner.keys = list(keys)
+        interner.ids = dict(zip(interner.keys, range(len(interner.keys))))
+        assert len(interner.ids) == len(interner.keys), "got duplicated keys"
+        return interner
+
+    def __getitem__(self, key: TKey) -> int:
+        return self.ids[key]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+@dataclass
+class CSR:
+    """ Compressed sparse rows: row `i` is `values[offsets[i]:offsets[i+1]]` """
+
+    offsets: np.ndarray
+    values: np.ndarray
 
-TCandidateKey = str
-TRouteKey = str
-TCustomerKey = str
+    def __getitem__(self, row: int) -> list[int]:
+        return self.values[self.offsets[row]:self.offsets[row + 1]].tolist()
 
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
 
-# TODO fancy/optimized keys
+
+@dataclass
+class TraceArrays:
+    """
+    Columnar (CSR) form of a trace: routes of candidate `c` are
+    `candidate_routes[candidate_offsets[c]:candidate_offsets[c+1]]` sorted by
+    score in descending order (scores are in `candidate_scores` at the same
+    positions), and customers of route `r` are
+    `route_customers[route_offsets[r]:route_offsets[r+1]]`. `*_keys` map
+    ids back to original keys. `baseline_routes[c]` is candidate's route in
+    the production assignment or -1, `None` if unknown.
+    """
+
+    candidate_keys: np.ndarray
+    route_keys: np.ndarray
+    customer_keys: np.ndarray
+    candidate_offsets: np.ndarray
+    candidate_routes: np.ndarray
+    candidate_scores: np.ndarray
+    route_offsets: np.ndarray
+    route_customers: np.ndarray
+    baseline_routes: np.ndarray | None = None
 
 
 class Trace:
+    """
+    Candidates, routes and customers are interned into dense integer ids at
+    construction time, so `candidates` and `customers_by_route` are lists
+    indexed by candidate and route id respectively. Original keys are kept in
+    `candidate_keys`, `route_keys` and `customer_keys` interners.
+
+    Trace can also be backed by `TraceArrays` (see `from_arrays`), e.g.
+    memory mapped ones (see `lib.load_trace`). Then all the python structures
+    above are materialized lazily on the first access.
+
+    `baseline` is the production assignment (candidate -> route), which
+    scores `yandex_score`.
+
+    With `bitsets=True` each route's customers are also kept as a python
+    big-int mask in `customer_masks`, so overlap checks are a single AND.
+    Masks take `routes * customers / 8` bytes at worst, hence are optional.
+    """
+
     def __init__(
         self,
         *,
-        candidates: dict[TCandidateKey, dict[TRouteKey, float]] = {},
-        customers_by_route: dict[TRouteKey, set[TCandidateKey]] = {},
+        candidates: dict[tp.Hashable, dict[tp.Hashable, float]] = {},
+        customers_by_route: dict[tp.Hashable, set[tp.Hashable]] = {},
+        baseline: dict[tp.Hashable, tp.Hashable] = {},
         yandex_score: float = 0,
+        bitsets: bool = False,
     ) -> None:
-        self.candidates = candidates
-        self.customers_by_route = customers_by_route
+        self.candidate_keys = Interner(candidates.keys())
+        self.route_keys = Interner(customers_by_route.keys())
+        self.customer_keys = Interner()
+
+        self.candidates_linear = [
+            sorted(
+                ((self.route_keys.intern(route), score) for route, score in routes.items()),
+                key=lambda item: item[1], reverse=True,
+            )
+            for routes in candidates.values()
+        ]
+        self.customers_by_route = [
+            {self.customer_keys.intern(customer) for customer in customers}
+            for customers in customers_by_route.values()
+        ]
+        self.baseline = self.intern_assignment(baseline)
         self.yandex_score = yandex_score
+        self.bitsets = bitsets
+
+    @staticmethod
+    def from_arrays(arrays: TraceArrays, *, yandex_score: float = 0, bitsets: bool = False) -> Trace:
+        trace = Trace.__new__(Trace)
+        trace.arrays = arrays
+        trace.yandex_score = yandex_score
+        trace.bitsets = bitsets
+        return trace
+
+    @cached_property
+    def arrays(self) -> TraceArrays:
+        routes_n_scores = [item for routes in self.candidates_linear for item in routes]
+        routes, scores = zip(*routes_n_scores) if routes_n_scores else ((), ())
+        return TraceArrays(
+            candidate_keys=np.array(self.candidate_keys.keys),
+            route_keys=np.array(self.route_keys.keys),
+            customer_keys=np.array(self.customer_keys.keys),
+            candidate_offsets=np.cumsum([0] + [len(routes) for routes in self.candidates_linear]),
+            candidate_routes=np.array(routes, dtype=np.int64),
+            candidate_scores=np.array(scores),
+            route_offsets=np.cumsum([0] + [len(customers) for customers in self.customers_by_route]),
+            route_customers=np.array([c for customers in self.customers_by_route for c in customers], dtype=np.int64),
+            baseline_routes=np.array(
+                [self.baseline.get(candidate, -1) for candidate in range(len(self.candidates_linear))], dtype=np.int64,
+            ),
+        )
+
+    @property
+    def candidates_count(self) -> int:
+        """ `len(candidates)`, without materializing python structures of array-backed trace """
+        if 'candidates_linear' in self.__dict__:
+            return len(self.candidates_linear)
+        return len(self.arrays.candidate_keys)
+
+    @property
+    def customers_count(self) -> int:
+        """ `len(customer_keys)`, see `candidates_count` """
+        if 'customer_keys' in self.__dict__:
+            return len(self.customer_keys)
+        return len(self.arrays.customer_keys)
+
+    @cached_property
+    def candidate_keys(self) -> Interner:
+        return Interner.from_unique(self.arrays.candidate_keys.tolist())
+
+    @cached_property
+    def route_keys(self) -> Interner:
+        return Interner.from_unique(self.arrays.route_keys.tolist())
+
+    @cached_property
+    def customer_keys(self) -> Interner:
+        return Interner.from_unique(self.arrays.customer_keys.tolist())
+
+    @cached_property
+    def candidates_linear(self) -> list[list[tuple[TRouteKey, float]]]:
+        """ candidate's routes and scores sorted by score in descending order """
+        routes, scores = self.arrays.candidate_routes.tolist(), self.arrays.candidate_scores.tolist()
+        return [
+            list(zip(routes[begin:end], scores[begin:end]))
+            for begin, end in pairwise(self.arrays.candidate_offsets.tolist())
+        ]
+
+    @cached_property
+    def customers_by_route(self) -> list[set[TCustomerKey]]:
+        customers = self.arrays.route_customers.tolist()
+        return [set(customers[begin:end]) for begin, end in pairwise(self.arrays.route_offsets.tolist())]
+
+    @cached_property
+    def baseline(self) -> dict[TCandidateKey, TRouteKey]:
+        if self.arrays.baseline_routes is None:
+            return {}
+        return {
+            candidate: route
+            for candidate, route in enumerate(self.arrays.baseline_routes.tolist())
+            if route != -1
+        }
+
+    @cached_property
+    def candidates(self) -> list[dict[TRouteKey, float]]:
+        return [dict(routes) for routes in self.candidates_linear]
+
+    @cached_property
+    def sorted_scores(self) -> list[tuple[float, ...]]:
+        return [tuple(score for _route, score in routes) for routes in self.candidates_linear]
+
+    @cached_property
+    def customer_masks(self) -> list[int] | None:
+        if not self.bitsets:
+            return None
+        return [sum(1 << customer for customer in customers) for customers in self.customers_by_route]
+
+    @cached_property
+    def _route_samplers(self) -> dict[tuple[TCandidateKey, float | None], AliasTable]:
+        return {}
+
+    def get_route_sampler(self, candidate: TCandidateKey, temperature: float | None=None) -> AliasTable:
+        """
+        Cached sampler of indices in `candidates_linear[candidate]`, weighted
+        by scores, or by `softmax(scores / temperature)` if temperature is set.
+        """
+
+        key = (candidate, temperature)
+        sampler = self._route_samplers.get(key)
+        if sampler is None:
+            scores = np.array(self.sorted_scores[candidate], dtype=np.float64)
+            if temperature is not None:
+                # subtract max to deal with overflow
+                scores = np.exp((scores - scores.max()) / temperature)
+            sampler = self._route_samplers[key] = AliasTable(scores.tolist())
+        return sampler
+
+    @cached_property
+    def candidate_customers(self) -> list[frozenset[TCustomerKey]]:
+        """ all customers candidate's routes touch """
+        return [
+            frozenset().union(*(self.customers_by_route[route] for route, _score in routes))
+            for routes in self.candidates_linear
+        ]
+
+    @cached_property
+    def routes_by_customer(self) -> CSR:
+        """ inverted index customer -> routes, computed on first access """
+        route_offsets, route_customers = self.arrays.route_offsets, self.arrays.route_customers
+        customer_route = np.repeat(np.arange(len(route_offsets) - 1), np.diff(route_offsets))
+        order = np.argsort(route_customers, kind='stable')
+        return CSR(_offsets(route_customers, len(self.arrays.customer_keys)), customer_route[order])
+
+    @cached_property
+    def route_conflicts(self) -> CSR:
+        """
+        Route -> other routes sharing at least one customer, computed on first
+        access. Takes `sum(routes_on_customer ** 2)` memory while building.
+        """
+
+        routes_by_customer = self.routes_by_customer
+        route_offsets, route_customers = self.arrays.route_offsets, self.arrays.route_customers
+        route = np.repeat(np.arange(len(route_offsets) - 1), np.diff(route_offsets))
+
+        # for every (route, customer) pair enumerate all routes on the customer
+        begins, ends = routes_by_customer.offsets[route_customers], routes_by_customer.offsets[route_customers + 1]
+        counts = ends - begins
+        shifts = np.repeat(begins - np.cumsum(counts) + counts, counts)
+        neighbours = routes_by_customer.values[np.arange(counts.sum()) + shifts]
+        route = np.repeat(route, counts)
+
+        n = len(route_offsets) - 1
+        pairs = np.unique(route[route != neighbours] * n + neighbours[route != neighbours])
+        return CSR(_offsets(pairs // n, n), pairs % n)
+
+    def get_candidates(self) -> dict[tp.Hashable, dict[tp.Hashable, float]]:
+        """ `candidates` with original keys """
+        return {
+            self.candidate_keys.keys[candidate]: {self.route_keys.keys[route]: score for route, score in routes.items()}
+            for candidate, routes in enumerate(self.candidates)
+        }
+
+    def intern_assignment(self, assignment: dict[tp.Hashable, tp.Hashable]) -> dict[TCandidateKey, TRouteKey]:
+        """ candidate -> route assignment with original keys to ids """
+        return {self.candidate_keys[candidate]: self.route_keys[route] for candidate, route in assignment.items()}
+
+    def get_assignment(self, assignment: dict[TCandidateKey, TRouteKey]) -> dict[tp.Hashable, tp.Hashable]:
+        """ candidate -> route assignment with ids to original keys """
+        return {self.candidate_keys.keys[candidate]: self.route_keys.keys[route] for candidate, route in assignment.items()}
+
+    def get_customers_by_route(self) -> dict[tp.Hashable, set[tp.Hashable]]:
+        """ `customers_by_route` with original keys """
+        return {
+            self.route_keys.keys[route]: {self.customer_keys.keys[customer] for customer in customers}
+            for route, customers in enumerate(self.customers_by_route)
+        }
+
+
+def _offsets(codes: np.ndarray, n: int) -> np.ndarray:
+    """ CSR offsets for values grouped by `codes` in `0..n-1` """
+    return np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n))])
+
+
+def _drop_duplicates(frame: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    """ like dict construction: duplicates take the position of the first one and values of the last one """
+    codes = frame.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    last = np.full(codes.max() + 1 if len(codes) else 0, -1, dtype=np.int64)
+    np.maximum.at(last, codes, np.arange(len(codes)))
+    return frame.iloc[last]
+
+
+def from_df(trace: pd.DataFrame, routes: pd.DataFrame, **kwargs) -> Trace:
+    """
+    Vectorized construction, no python code is run per row. Duplicated
+    (candidate, route) pairs and duplicated routes are resolved just like
+    dict construction would do (see `_drop_duplicates`). `yandex_score` sums
+    all chosen rows, duplicated ones included.
+    """
+
+    all_chosen = trace['chosen_for_proposition_flg'].to_numpy(dtype=bool)
+    yandex_score = trace['score'].to_numpy()[all_chosen].sum()
+    trace = _drop_duplicates(trace, ['candidate_id', 'route_id'])
+    routes = _drop_duplicates(routes, ['route_id'])
+
+    candidate_codes, candidate_keys = pd.factorize(trace['candidate_id'], sort=True)
+    route_codes, route_keys = pd.factorize(pd.concat([routes['route_id'], trace['route_id']], ignore_index=True))
+    routes_route_codes, trace_route_codes = route_codes[:len(routes)], route_codes[len(routes):]
+
+    # candidate -> routes, sorted by score in descending order, stable
+    scores = trace['score'].to_numpy()
+    order = np.lexsort((-scores, candidate_codes))
+    candidate_offsets = _offsets(candidate_codes, len(candidate_keys))
 
-        self.candidates_linear, self.sorted_scores = dict(), dict()
-        for candidate, routes in candidates.items():
-            sorted_routes_n_scores = sorted(routes.items(), key=lambda item: item[1], reverse=True)
-            self.candidates_linear[candidate] = sorted_routes_n_scores
-            _, self.sorted_scores[candidate] = zip(*sorted_routes_n_scores)
+    # route -> customers, empty routes are exploded to NaN
+    customers = pd.Series(routes['claim_segment_uuid_list'].to_numpy(), index=routes_route_codes).explode().dropna()
+    customer_codes, customer_keys = pd.factorize(customers)
+    customer_route_codes = customers.index.to_numpy()
+    customer_order = np.argsort(customer_route_codes, kind='stable')
+    route_offsets = _offsets(customer_route_codes, len(route_keys))
 
+    # production assignment, the last chosen route wins
+    chosen = trace['chosen_for_proposition_flg'].to_numpy(dtype=bool)
+    baseline_routes = np.full(len(candidate_keys), -1, dtype=np.int64)
+    baseline_routes[candidate_codes[chosen]] = trace_route_codes[chosen]
 
-def from_df(trace: pd.DataFrame, routes: pd.DataFrame) -> Trace:
-    return Trace(
-        candidates=dict(trace.groupby('candidate_id').apply(lambda df: dict(zip(df['route_id'], df['score'])))),
-        customers_by_route={row.route_id: set(row.claim_segment_uuid_list) for _, row in routes.iterrows()},
-        yandex_score=trace[trace.chosen_for_proposition_flg].score.sum(),
+    arrays = TraceArrays(
+        candidate_keys=candidate_keys.to_numpy(),
+        route_keys=route_keys.to_numpy(),
+        customer_keys=customer_keys.to_numpy(),
+        candidate_offsets=candidate_offsets,
+        candidate_routes=trace_route_codes[order],
+        candidate_scores=scores[order],
+        route_offsets=route_offsets,
+        route_customers=customer_codes[customer_order],
+        baseline_routes=baseline_routes,
     )
+    return Trace.from_arrays(arrays, yandex_score=yandex_score, **kwargs)
@@ -0,0 +1,52 @@
+"""
+Worker processes of the parallel engines (see `lib.beamsearch`,
+`lib.tempering`, `Solver.solve_all`).
+
+Workers are forked where possible, so their arguments (solutions, metrics,
+mutations, solvers) are not pickled, otherwise they must be picklable.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import multiprocessing
+import typing as tp
+from multiprocessing.connection import Connection
+
+
+def fork_context():
+    """ multiprocessing context, which forks where possible """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+
+@contextlib.contextmanager
+def workers(target: tp.Callable[..., None], args: tp.Iterable[tuple]) -> tp.Iterator[list[Connection]]:
+    """
+    Starts a daemon process `target(conn, *worker_args)` per `args`, and
+    yields the other ends of their connections. On exit, also when the
+    driver fails, `None` (the stop message) is sent to every worker, which
+    are then joined, and terminated if still alive after a second.
+    """
+    context = fork_context()
+    conns, processes = [], []
+    try:
+        for worker_args in args:
+            conn, worker_conn = context.Pipe()
+            process = context.Process(target=target, args=(worker_conn, *worker_args), daemon=True)
+            process.start()
+            worker_conn.close()
+            conns.append(conn)
+            processes.append(process)
+        yield conns
+    finally:
+        for conn in conns:
+            try:
+                conn.send(None)
+            except OSError:
+                # the worker has stopped already
+                pass
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()